@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+from lxml import etree
+import re
+
+
+# Every element the analysis looks at, in document order.
+# $headings and $ids are space separated lists (see word_list), $epubns is the epub namespace URI, or ''
+SCAN_XPATH = etree.XPath(
+    '//*[local-name()="body" or local-name()="title" or local-name()="svg" or local-name()="img"'
+    ' or contains($headings, concat(" ", local-name(), " "))'
+    ' or contains($ids, concat(" ", @id, " "))'
+    ' or ($epubns != "" and @*[local-name()="type" and namespace-uri()=$epubns])]')
+
+
+# Start tag of an image, whatever its namespace prefix
+RE_IMAGE_TAG = re.compile(r'<(?:[\w.-]+:)?(?:img|svg)[\s/>]')
+RE_IMAGE_TAG_ANY_CASE = re.compile(RE_IMAGE_TAG.pattern, re.IGNORECASE)
+RE_ROOT_TAG = re.compile(r'<html\b[^>]*>')
+RE_INTRODUCTION = re.compile(r'introduction', re.IGNORECASE)
+
+
+def quick_scan(text):
+    """
+    Read the chapter score inputs of an (x)html document from its source, without parsing it
+
+    Return (epub namespace declared, introductions count, images count) as ``ChapterAnalysis``
+    would find them, or None when the source has comments, unusual markup or possible
+    introductions, so that only a full parse can tell.
+    """
+    if '<!--' in text or '<![CDATA[' in text or '<!ENTITY' in text:
+        return None
+    root = RE_ROOT_TAG.search(text)
+    if root is None:
+        return None
+    epub = 'xmlns:epub=' in root.group(0)
+    if epub and RE_INTRODUCTION.search(text) is not None:
+        return None  # is it an epub:type value, in the epub namespace?
+    images_count = len(RE_IMAGE_TAG.findall(text))
+    if len(RE_IMAGE_TAG_ANY_CASE.findall(text)) != images_count:
+        return None  # upper case tags, which the parser may or may not fold
+    return epub, 0, images_count
+
+
+def word_list(values):
+    """Format values as a space separated list, matched with ``contains($list, concat(" ", value, " "))``"""
+    return ' ' + ' '.join(values) + ' '
+
+
+def enclosed_text(element):
+    """
+    Return the rendered contents of an element
+
+    Convert inner text/nodes to text using ``lxml``, regardless of spans etc.
+    """
+    return etree.tostring(element, method='text', encoding="UTF-8").strip()
+
+
+class ChapterAnalysis(object):
+    """
+    Facts about an (x)html document, gathered in a single pass over its tree
+
+    A single precompiled XPath query selects every element of interest in document order,
+    which are then sorted out here, instead of running one full-tree query per question.
+    """
+
+    def __init__(self, root, tracker_ids, headings):
+        """Analyse parsed document root, looking for tracker_ids elements and headings titles"""
+        self.root = root
+        self.epub_ns = root.nsmap.get('epub')  # None if the epub namespace is not declared
+        self.body = None
+        self.tracker = None  # existing element holding the QR image
+        self.images_count = 0
+        self.introductions_count = 0
+        self.title = None  # best title candidate, None if the document has none
+        self._scan(tracker_ids, headings)
+
+
+    def _scan(self, tracker_ids, headings):
+        """Walk the tree once, filling in attributes"""
+        tracker_ids = frozenset(tracker_ids)
+        epub_type = '{' + '{0}'.format(self.epub_ns) + '}type'
+
+        first_headings = {}
+        epub_title_headings = {}
+        chapter_title = None
+        title_text = None
+        nodes = SCAN_XPATH(self.root,
+                           headings=word_list(headings),
+                           ids=word_list(tracker_ids),
+                           epubns=self.epub_ns or '')
+        for node in nodes:
+            local_name = etree.QName(node).localname
+            if local_name == 'body':
+                if self.body is None:
+                    self.body = node
+            elif local_name in ('svg', 'img'):
+                self.images_count += 1
+            elif node.tag == 'title':  # <title> outside of any namespace
+                if title_text is None and (node.text or '').strip() != '':
+                    title_text = node.text.strip()
+            elif local_name in headings:
+                first_headings.setdefault(local_name, node)
+            if self.tracker is None and node.get('id') in tracker_ids:
+                self.tracker = node
+            kind = node.get(epub_type) if self.epub_ns is not None else None
+            if kind is None:
+                continue
+            if kind.lower() == 'introduction':
+                self.introductions_count += 1
+            if kind == 'title' and local_name in headings:
+                epub_title_headings.setdefault(local_name, node)
+            elif kind == 'chapter' and chapter_title is None and (node.get('title') or '').strip() != '':
+                chapter_title = node.get('title').strip()
+
+        # Order of preference: epub titles, epub chapter title, <title> and finally plain headings
+        if self.epub_ns is not None:
+            for heading in headings:
+                if heading in epub_title_headings:
+                    self.title = enclosed_text(epub_title_headings[heading])
+                    return
+            if chapter_title is not None:
+                self.title = chapter_title
+                return
+        if title_text is not None:
+            self.title = title_text
+            return
+        for heading in headings:
+            if heading in first_headings:
+                self.title = enclosed_text(first_headings[heading])
+                return
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import errno
+import os
+
+
+def write_atomically(path, data, replace=True):
+    """
+    Write data (bytes) to the file at path, creating its directory if needed
+
+    The data goes to a temporary file first, renamed once complete, so that readers never see
+    a partial file. If replace is False, an existing file is kept as it is.
+    Return True if the file was written, False if it was kept or on failure: callers are caches,
+    which only lose an optimization when a write fails, so errors are not raised.
+    """
+    if not replace and os.path.exists(path):
+        return False
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        if replace and os.path.exists(path):
+            os.remove(path)  # os.rename does not replace files on Windows
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+    return True
@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+"""
+Standalone benchmarks, run from the repository root, e.g. ``python -m benchmarks.qr_engine --help``
+
+They do not need calibre.
+"""
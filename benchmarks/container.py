@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+from collections import OrderedDict
+from lxml import etree
+import posixpath
+try:
+    from urllib.parse import quote, unquote
+except ImportError:  # Python 2
+    from urllib import quote, unquote
+
+
+class StubContainer(object):
+    """
+    In-memory stand-in for ``calibre.ebooks.oeb.polish.container.Container``
+
+    Only implements what the plugin uses. Files are kept in manifest order; (x)html files
+    are parsed with ``lxml`` on first access and serialized back when read after being dirtied.
+    """
+
+    def __init__(self, mi=None):
+        """Create an empty book, with mi metadata (a ``calibre.ebooks.metadata.book.base.Metadata``)"""
+        self.mi = mi
+        self.data = OrderedDict()  # name -> bytes, or text for (x)html files
+        self.mime_map = {}
+        self.parsed_cache = {}
+        self.dirtied = set()
+        self.names_that_must_not_be_removed = set()
+
+    def add_file(self, name, data, media_type=None, spine_index=None, modify_name_if_needed=False,
+                 process_manifest_item=None):
+        """Add a file to the book and return its name"""
+        if name in self.data:
+            raise ValueError('A file with the name {0} already exists'.format(name))
+        self.data[name] = data
+        self.mime_map[name] = media_type or 'application/octet-stream'
+        return name
+
+    def remove_item(self, name, remove_from_guide=True):
+        """Remove a file from the book, if it exists"""
+        self.data.pop(name, None)
+        self.mime_map.pop(name, None)
+        self.parsed_cache.pop(name, None)
+        self.dirtied.discard(name)
+
+    def has_name(self, name):
+        """Tell whether a file exists"""
+        return name in self.data
+
+    def parsed(self, name):
+        """Return the root of a parsed (x)html file"""
+        root = self.parsed_cache.get(name)
+        if root is None:
+            root = self.parsed_cache[name] = etree.fromstring(self.raw_data(name).encode('utf-8'))
+        return root
+
+    def raw_data(self, name, decode=True, normalize_to_nfc=True):
+        """Return the contents of a file, committing parsed changes first"""
+        if name in self.dirtied:
+            self.commit_item(name)
+        return self.data[name]
+
+    def commit_item(self, name):
+        """Serialize a parsed file back into its contents"""
+        self.data[name] = etree.tostring(self.parsed_cache[name], encoding='utf-8', xml_declaration=True).decode('utf-8')
+        self.dirtied.discard(name)
+
+    def dirty(self, name):
+        """Mark a parsed file as changed"""
+        self.dirtied.add(name)
+
+    def manifest_items_of_type(self, predicate):
+        """Yield the names of files whose media type is in predicate (or for which predicate is true)"""
+        matches = predicate if callable(predicate) else predicate.__contains__
+        for name in list(self.data):
+            if matches(self.mime_map[name]):
+                yield name
+
+    def href_to_name(self, href, base):
+        """Resolve a link in file base to a file name"""
+        return posixpath.normpath(posixpath.join(posixpath.dirname(base), unquote(href.partition('#')[0])))
+
+    def name_to_href(self, name, base):
+        """Return the link to file name, from file base"""
+        return quote(posixpath.relpath(name, posixpath.dirname(base) or '.'))
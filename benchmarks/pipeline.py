@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+"""
+Benchmark the whole tracker pipeline on synthetic books, without the calibre GUI
+
+The plugin runs against an in-memory ``StubContainer`` holding a synthetic book, and the time
+spent in each stage (chapter scoring, title lookup, up to date checks, QR encoding, changes to
+the book) is reported, as measured by the plugin ``StageTimer``.
+Print a summary to stderr and JSON results to stdout (or --output).
+
+The plugin imports calibre, so run it with calibre's interpreter, from the repository root:
+calibre-debug -e benchmarks/pipeline.py -- --chapters 10,100,2000
+"""
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import make_book
+
+clock = getattr(time, 'perf_counter', time.time)
+
+PLUGIN_PACKAGE = 'calibre_plugins.qrcode_tracker_philidel'
+
+
+def load_plugin_module():
+    """Import the plugin main module from this repository, as calibre would from the plugin zip file"""
+    if 'calibre_plugins' not in sys.modules:
+        try:
+            import calibre_plugins  # noqa: F401 (calibre's plugin importer)
+        except ImportError:
+            sys.modules['calibre_plugins'] = types.ModuleType(str('calibre_plugins'))
+            sys.modules['calibre_plugins'].__path__ = []
+    package = types.ModuleType(str(PLUGIN_PACKAGE))
+    package.__path__ = [ROOT]
+    sys.modules[PLUGIN_PACKAGE] = package
+    import importlib
+    return importlib.import_module(PLUGIN_PACKAGE + '.main')
+
+
+class StubPrefs(dict):
+    """Plugin preferences, in memory"""
+
+    def __init__(self, defaults, file_path):
+        """Start from defaults, pretending to be stored in file_path"""
+        dict.__init__(self, defaults)
+        self.defaults = defaults
+        self.file_path = file_path
+
+
+class StubBoss(object):
+    """Stand-in for the editor ``Boss``"""
+
+    def commit_dirty_opf(self):
+        pass
+
+    def close_editor(self, name):
+        pass
+
+
+def benchmark_plugin_class(main):
+    """Return a subclass of the plugin running against a given container, with timing enabled"""
+    plugin_class = main.EditBook_QrCodeTrackerFilidelPlugin
+
+    class BenchmarkPlugin(plugin_class):
+        """Plugin working on a given container, with in-memory preferences"""
+
+        act_on_current = False
+
+        def __init__(self, container, prefs_dir, **prefs):
+            plugin_class.__init__(self)
+            self.cprefs = StubPrefs(self.cprefs.defaults, os.path.join(prefs_dir, self.name + '.json'))
+            self.cprefs.update(prefs)
+            self.container = container
+            self.timer = main.StageTimer()
+            self.stub_boss = StubBoss()
+
+        @property
+        def current_container(self):
+            return self.container
+
+        @property
+        def boss(self):
+            return self.stub_boss
+
+        def book_names(self, container):
+            # synthetic books have no cover page, nor OPF to find it in
+            return list(container.manifest_items_of_type(main.OEB_DOCS))
+
+    return BenchmarkPlugin
+
+
+def run(main, chapters, runs, epub3, prefs_dir, prefs):
+    """Yield a result dict per run of the plugin against a synthetic book of the given number of chapters"""
+    from calibre.ebooks.metadata.book.base import Metadata
+
+    plugin_class = benchmark_plugin_class(main)
+    start = clock()
+    container = make_book(chapters, epub3=epub3, mi=Metadata('Benchmark', ['Nobody']))
+    generate_seconds = clock() - start
+    size = sum(len(container.raw_data(name)) for name in container.manifest_items_of_type(main.OEB_DOCS))
+    for i in range(runs):
+        plugin = plugin_class(container, prefs_dir, **prefs)
+        start = clock()
+        num_qr, num_max, num_skipped, grouped_exc = plugin.process_files()
+        total = clock() - start
+        stages = dict((stage, {'seconds': seconds, 'calls': calls})
+                      for stage, (seconds, calls) in plugin.timer.stages.items())
+        yield {
+            'chapters': chapters,
+            'epub3': epub3,
+            'run': i + 1,
+            'html_bytes': size,
+            'generate_seconds': generate_seconds,
+            'total_seconds': total,
+            'stages': stages,
+            'counters': dict(plugin.timer.counters),
+            'num_qr': num_qr,
+            'num_candidates': num_max,
+            'num_skipped': num_skipped,
+            'errors': grouped_exc.messages if grouped_exc is not None else [],
+        }
+
+
+def parse_args(argv):
+    if argv[:1] == ['--']:
+        argv = argv[1:]
+    parser = argparse.ArgumentParser(prog='calibre-debug -e benchmarks/pipeline.py --',
+                                     description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--chapters', default='10,100,500,2000',
+                        help='comma separated numbers of chapters of the synthetic books (default: 10,100,500,2000)')
+    parser.add_argument('--runs', type=int, default=2,
+                        help='runs against each book, the later ones finding QR images in place (default: 2)')
+    parser.add_argument('--epub2', action='store_true', help='generate books without the epub namespace')
+    parser.add_argument('--image-format', choices=('png', 'svg'), default='png')
+    parser.add_argument('--cache', action='store_true',
+                        help='enable the image and feature caches, in a temporary directory shared by all runs')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+    args.chapters = [int(x) for x in args.chapters.split(',') if x]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    plugin_main = load_plugin_module()
+    prefs = {
+        'image_format': args.image_format,
+    }
+    if not args.cache:
+        prefs['image_cache_size'] = 0
+        prefs['feature_cache_size'] = 0
+
+    prefs_dir = tempfile.mkdtemp(prefix='qrtracker-bench-')
+    results = []
+    try:
+        for chapters in args.chapters:
+            for result in run(plugin_main, chapters, args.runs, not args.epub2, prefs_dir, prefs):
+                results.append(result)
+                stages = ', '.join('{0} {1:.3f}s'.format(stage, times['seconds'])
+                                   for stage, times in sorted(result['stages'].items()))
+                print('{chapters:>5} chapters, run {run}: {total_seconds:8.3f}s, {num_qr} QR images added, '
+                      '{num_skipped} up to date'.format(**result), file=sys.stderr)
+                print('    ' + stages, file=sys.stderr)
+    finally:
+        shutil.rmtree(prefs_dir, ignore_errors=True)
+
+    text = json.dumps({'results': results}, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
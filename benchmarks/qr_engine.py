@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+"""
+Benchmark the vendored QR engine (``extern``) stage by stage
+
+For every code version, error correction level and payload kind, time ``QRCode.add_data``,
+``QRCode.best_fit``, ``util.create_data``, ``QRCode.best_mask_pattern``, ``util.lost_point``
+and ``QRCode.make_image`` + ``save``, with a payload filling the code to capacity.
+Print a summary to stderr and JSON results to stdout (or --output), which --compare reads back.
+
+Run from the repository root: python -m benchmarks.qr_engine --versions 1-10 --levels M
+"""
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from extern import constants, util
+from extern.main import QRCode
+
+clock = getattr(time, 'perf_counter', time.time)
+
+LEVELS = {
+    'L': constants.ERROR_CORRECT_L,
+    'M': constants.ERROR_CORRECT_M,
+    'Q': constants.ERROR_CORRECT_Q,
+    'H': constants.ERROR_CORRECT_H,
+}
+
+# Characters payloads are made of, cycled over
+PAYLOAD_ALPHABETS = {
+    'numeric': '0123456789',
+    'alphanumeric': '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:',
+    'utf8': 'Compl\xe9t\xe9 日本語 - Да ',
+}
+
+STAGES = ('add_data', 'best_fit', 'create_data', 'best_mask_pattern', 'lost_point', 'make_image')
+
+
+def payload(kind, length):
+    """Return a payload of length characters"""
+    alphabet = PAYLOAD_ALPHABETS[kind]
+    return (alphabet * (length // len(alphabet) + 1))[:length]
+
+
+def fitting_payload(kind, version, error_correction):
+    """Return the longest payload fitting in a code of the given version, split as ``QRCode.add_data`` does"""
+    limit = util.BIT_LIMIT_TABLE[error_correction][version]
+    low, high = 1, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if sum(x.bit_length(version) for x in util.optimal_data_chunks(payload(kind, middle))) <= limit:
+            low = middle
+        else:
+            high = middle - 1
+    return payload(kind, low)
+
+
+def image_factory(name):
+    """Return the image class called name"""
+    if name == 'pil':
+        from extern.image.pil import PilRasterImage
+        return PilRasterImage
+    if name == 'svg':
+        from extern.image.svg import SvgPathImage
+        return SvgPathImage
+    from extern.image.pure import PurePngImage
+    return PurePngImage
+
+
+def stage_functions(version, error_correction, data, factory):
+    """Return a dict of stage names to functions running one operation of that stage"""
+    def add_data():
+        QRCode(error_correction=error_correction).add_data(data)
+
+    filled = QRCode(error_correction=error_correction)
+    filled.add_data(data)
+
+    def best_fit():
+        filled.best_fit()
+
+    def create_data():
+        # fresh segments, as their encoded bits are cached
+        util.create_data(version, error_correction,
+                         [util.QRData(x.data, x.mode, check_data=False) for x in filled.data_list])
+
+    made = QRCode(version=version, error_correction=error_correction, image_factory=factory)
+    made.add_data(data)
+    made.make(fit=False)
+    modules = made.modules
+
+    def best_mask_pattern():
+        made.best_mask_pattern()
+        made.modules = modules
+
+    def lost_point():
+        util.lost_point(modules)
+
+    def make_image():
+        made.make_image().save(io.BytesIO())
+
+    return {
+        'add_data': add_data,
+        'best_fit': best_fit,
+        'create_data': create_data,
+        'best_mask_pattern': best_mask_pattern,
+        'lost_point': lost_point,
+        'make_image': make_image,
+    }
+
+
+def measure(func, min_time):
+    """
+    Return operations per second and peak traced memory (in bytes, None without tracemalloc) of func
+
+    The function is called once to warm up caches, then repeatedly for at least min_time seconds.
+    Memory is traced during a separate call, as tracing slows everything down.
+    """
+    func()
+    count = 0
+    start = clock()
+    elapsed = 0
+    while elapsed < min_time:
+        func()
+        count += 1
+        elapsed = clock() - start
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return count / elapsed, peak
+
+
+def run(versions, levels, kinds, stages, min_time, factory):
+    """Yield a result dict per (version, level, kind, stage)"""
+    for version in versions:
+        for level in levels:
+            for kind in kinds:
+                data = fitting_payload(kind, version, LEVELS[level])
+                functions = stage_functions(version, LEVELS[level], data, factory)
+                for stage in stages:
+                    ops, peak = measure(functions[stage], min_time)
+                    yield {
+                        'stage': stage,
+                        'version': version,
+                        'error_correction': level,
+                        'payload': kind,
+                        'length': len(data),
+                        'ops_per_sec': ops,
+                        'peak_bytes': peak,
+                    }
+
+
+def result_key(result):
+    """Return what identifies a measure across runs"""
+    return (result['stage'], result['version'], result['error_correction'], result['payload'])
+
+
+def parse_versions(text):
+    """Parse a comma separated list of versions and ranges, e.g. 1-10,20,40"""
+    versions = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        versions.extend(range(int(first), int(last or first) + 1))
+    if not versions or min(versions) < 1 or max(versions) > 40:
+        raise argparse.ArgumentTypeError('versions must be in 1-40')
+    return versions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.qr_engine', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--versions', type=parse_versions, default=list(range(1, 41)),
+                        help='versions and ranges of versions, e.g. 1-10,40 (default: 1-40)')
+    parser.add_argument('--levels', default='LMQH', help='error correction levels (default: LMQH)')
+    parser.add_argument('--payloads', default=','.join(sorted(PAYLOAD_ALPHABETS)),
+                        help='comma separated payload kinds among ' + ', '.join(sorted(PAYLOAD_ALPHABETS)))
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma separated stages among ' + ', '.join(STAGES))
+    parser.add_argument('--image', choices=('pure', 'svg', 'pil'), default='pure',
+                        help='image factory of the make_image stage (default: pure)')
+    parser.add_argument('--min-time', type=float, default=0.05, help='seconds spent measuring each stage (default: 0.05)')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='JSON results of a previous run, to print speedups against')
+    args = parser.parse_args(argv)
+    args.levels = [x for x in args.levels.upper() if x in LEVELS]
+    args.payloads = [x for x in args.payloads.split(',') if x]
+    args.stages = [x for x in args.stages.split(',') if x]
+    for kind in args.payloads:
+        if kind not in PAYLOAD_ALPHABETS:
+            parser.error('unknown payload kind: {0}'.format(kind))
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error('unknown stage: {0}'.format(stage))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = dict((result_key(x), x) for x in json.load(f)['results'])
+
+    results = []
+    for result in run(args.versions, args.levels, args.payloads, args.stages, args.min_time, image_factory(args.image)):
+        results.append(result)
+        line = '{stage:<18} v{version:<3} {error_correction} {payload:<13} {ops_per_sec:>12.1f} ops/s'.format(**result)
+        if result['peak_bytes'] is not None:
+            line += ' {0:>10} B peak'.format(result['peak_bytes'])
+        previous = baseline.get(result_key(result))
+        if previous is not None:
+            line += '  x{0:.2f}'.format(result['ops_per_sec'] / previous['ops_per_sec'])
+        print(line, file=sys.stderr)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'numpy': util._import_numpy() is not None,
+            'image': args.image,
+            'min_time': args.min_time,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import random
+
+from benchmarks.container import StubContainer
+
+XHTML_TYPE = 'application/xhtml+xml'
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore '
+         'magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo '
+         'consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat nulla pariatur').split()
+
+
+def document(title, body, epub3):
+    """Return the source of an xhtml document"""
+    namespaces = ' xmlns:epub="http://www.idpf.org/2007/ops"' if epub3 else ''
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml"{0}>\n'
+            '<head><title>{1}</title></head>\n'
+            '<body>\n{2}</body>\n</html>\n').format(namespaces, title, body)
+
+
+def paragraphs(rng, size):
+    """Return paragraphs of about size characters of text"""
+    parts = []
+    length = 0
+    while length < size:
+        text = ' '.join(rng.choice(WORDS) for i in range(rng.randint(20, 120)))
+        parts.append('<p>{0}.</p>\n'.format(text.capitalize()))
+        length += len(parts[-1])
+    return ''.join(parts)
+
+
+def images(rng, count, number):
+    """Return count image elements"""
+    return ''.join('<div><img src="../Images/img{0:04d}-{1}.jpg" alt=""/></div>\n'.format(number, i)
+                   for i in range(count))
+
+
+def chapter(rng, number, epub3):
+    """Return the source of a chapter: 2 to 60 KiB of text, with a few illustrations now and then"""
+    title = 'Chapter {0}'.format(number)
+    size = rng.randint(10240, 61440) if rng.random() < 0.3 else rng.randint(2048, 10240)
+    heading = '<h1 epub:type="title">{0}</h1>\n' if epub3 else '<h2>{0}</h2>\n'
+    body = heading.format(title) + paragraphs(rng, size)
+    if rng.random() < 0.2:
+        body += images(rng, rng.randint(1, 3), number)
+    return document(title, body, epub3)
+
+
+def gallery(rng, number, epub3):
+    """Return the source of an illustration gallery"""
+    return document('Illustrations', images(rng, rng.randint(4, 12), number), epub3)
+
+
+def introduction(rng, number, epub3):
+    """Return the source of an introduction page"""
+    body = paragraphs(rng, rng.randint(1024, 4096))
+    if epub3:
+        body = '<section epub:type="introduction">\n<h1 epub:type="title">Introduction</h1>\n{0}</section>\n'.format(body)
+    return document('Introduction', body, epub3)
+
+
+def make_book(chapters, seed=0, epub3=True, mi=None):
+    """
+    Return a ``StubContainer`` holding a synthetic book
+
+    Besides chapters chapter files of varied sizes, the book holds an introduction, and an
+    illustration gallery every 25 chapters, which the plugin is expected to skip.
+    """
+    rng = random.Random(seed)
+    container = StubContainer(mi)
+    container.add_file('Text/intro.xhtml', introduction(rng, 0, epub3), XHTML_TYPE)
+    for number in range(1, chapters + 1):
+        container.add_file('Text/chapter{0:04d}.xhtml'.format(number), chapter(rng, number, epub3), XHTML_TYPE)
+        if number % 25 == 0:
+            container.add_file('Text/gallery{0:04d}.xhtml'.format(number), gallery(rng, number, epub3), XHTML_TYPE)
+    return container
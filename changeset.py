@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+from collections import OrderedDict
+
+
+class ContainerChangeset(object):
+    """
+    Files to remove from and add to a book container, applied all at once
+
+    Every change to the manifest rewrites the OPF, so a run collects them here and applies them
+    in one go. Removals are applied before additions, so that a file may be replaced.
+    """
+
+    def __init__(self):
+        """Start with no change"""
+        self.removals = OrderedDict()  # name -> None, an ordered set
+        self.additions = OrderedDict()  # name -> (data, media type)
+
+    def __len__(self):
+        return len(self.removals) + len(self.additions)
+
+    def remove(self, name):
+        """Schedule the removal of a file, if it exists"""
+        self.removals[name] = None
+
+    def add(self, name, data, media_type=None):
+        """Schedule the addition of a file, and return its name"""
+        self.additions[name] = (data, media_type)
+        return name
+
+    def apply(self, container):
+        """Apply changes to container, return the names of the files removed"""
+        removed = []
+        for name in self.removals:
+            if container.has_name(name) and name not in container.names_that_must_not_be_removed:
+                container.remove_item(name)
+                removed.append(name)
+        for name, (data, media_type) in self.additions.items():
+            container.add_file(name, data, media_type=media_type)
+        self.removals.clear()
+        self.additions.clear()
+        return removed
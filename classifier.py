@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+from collections import namedtuple
+import hashlib
+import json
+
+from calibre_plugins.qrcode_tracker_philidel.analysis import quick_scan
+from calibre_plugins.qrcode_tracker_philidel.atomicwrite import write_atomically
+
+
+# Feature vector of a document: its size in characters, whether the epub namespace is declared,
+# the number of introduction sections and of images (both None for large documents, which are not scanned)
+ChapterFeatures = namedtuple('ChapterFeatures', 'size epub introductions images')
+
+
+def extract_features(text, analyse, large_size):
+    """
+    Return the ``ChapterFeatures`` of an (x)html document source
+
+    analyse() is called to obtain the document ``ChapterAnalysis`` when the source alone is not enough
+    """
+    if len(text) >= large_size:
+        return ChapterFeatures(len(text), False, None, None)
+    counts = quick_scan(text)
+    if counts is None:
+        analysis = analyse()
+        counts = (analysis.epub_ns is not None, analysis.introductions_count, analysis.images_count)
+    return ChapterFeatures(len(text), *counts)
+
+
+class ChapterModel(object):
+    """
+    Linear scoring of ``ChapterFeatures``, telling actual chapters from cover pages, galleries and so forth
+
+    Weights default to ``DEFAULT_WEIGHTS``, any of which may be overridden.
+    """
+
+    DEFAULT_WEIGHTS = {
+        'base': 0.8,
+        'large_size': 10240,  # documents this large are quite positively chapters, and score 'base'
+        'epub': 0.3,
+        'introduction': -0.7,  # per introduction section, in epub documents
+        'no_image': 0.3,
+        'image_density': -1024,  # times images per character
+        'min_score': 0.3,  # lowest score of a chapter
+    }
+
+    def __init__(self, weights=None):
+        """Store weights"""
+        self.weights = dict(self.DEFAULT_WEIGHTS)
+        self.weights.update(weights or {})
+
+    @property
+    def large_size(self):
+        """Size from which documents are not scanned"""
+        return self.weights['large_size']
+
+    @property
+    def min_score(self):
+        """Lowest score of a chapter"""
+        return self.weights['min_score']
+
+    def score(self, features):
+        """Return a decimal value in [0-1], the probability a document is a chapter"""
+        w = self.weights
+        score = w['base']
+        if features.size >= w['large_size'] or features.images is None:
+            return score
+        if features.epub:
+            score += w['epub']
+            score += w['introduction'] * features.introductions
+        if features.images < 1:
+            score += w['no_image']
+        else:
+            score += w['image_density'] * (features.images / features.size)
+        return max(0.0, min(1.0, score))
+
+
+class FeatureCache(object):
+    """
+    Persistent ``ChapterFeatures`` of documents, keyed by a hash of their contents
+
+    Entries are kept in a JSON file, dropping the least recently used ones beyond ``max_entries``.
+    """
+
+    def __init__(self, path, max_entries):
+        """Store cache location and size cap (in entries)"""
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = None
+        self.clock = 0  # orders accesses, oldest first
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text):
+        """Return the cache key of a document source"""
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def load(self):
+        """Read cache file, if any"""
+        self.entries = {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+            self.entries = dict((k, (int(t), ChapterFeatures(*v))) for k, (t, v) in data.items())
+        except (IOError, OSError, ValueError, TypeError):
+            pass
+        self.clock = max([t for t, features in self.entries.values()] or [0])
+
+    def get(self, key):
+        """Return the cached features, or None"""
+        if self.entries is None:
+            self.load()
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.clock += 1
+        self.entries[key] = (self.clock, entry[1])
+        self.dirty = True
+        return entry[1]
+
+    def put(self, key, features):
+        """Store features"""
+        if self.entries is None:
+            self.load()
+        self.clock += 1
+        self.entries[key] = (self.clock, features)
+        self.dirty = True
+
+    def save(self):
+        """Write cache file, if entries changed"""
+        if not self.dirty:
+            return
+        entries = sorted(self.entries.items(), key=lambda item: item[1][0])
+        entries = entries[max(0, len(entries) - self.max_entries):]
+        data = json.dumps(dict((k, (t, list(v))) for k, (t, v) in entries), separators=(',', ':'))
+        write_atomically(self.path, data.encode('utf-8'))
+        self.dirty = False
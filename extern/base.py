@@ -282,6 +282,61 @@ def gexp(n):
     return EXP_TABLE[n % 255]
 
 
+def gmul(a, b):
+    if not a or not b:
+        return 0
+    return EXP_TABLE[(LOG_TABLE[a] + LOG_TABLE[b]) % 255]
+
+
+# Reed-Solomon multiplication tables, keyed by error correction codeword count.
+_rs_tables = {}
+
+
+def rs_generator(ec_count):
+    """
+    Return the coefficients of the generator polynomial
+    ``(x - a^0)(x - a^1)...(x - a^(ec_count - 1))``, highest degree first.
+    """
+    generator = [1]
+    for i in range(ec_count):
+        factor = gexp(i)
+        generator = [
+            a ^ gmul(b, factor)
+            for a, b in zip(generator + [0], [0] + generator)]
+    return generator
+
+
+def rs_table(ec_count):
+    """
+    Return the cached 256 x ``ec_count`` table holding, for every byte value,
+    its products with the generator coefficients (leading term excluded).
+    """
+    table = _rs_tables.get(ec_count)
+    if table is None:
+        generator = rs_generator(ec_count)[1:]
+        table = [
+            [gmul(value, coefficient) for coefficient in generator]
+            for value in range(256)]
+        _rs_tables[ec_count] = table
+    return table
+
+
+def rs_encode(data, ec_count):
+    """
+    Compute the ``ec_count`` error correction codewords of a data block.
+
+    This is the polynomial division remainder of the block by the generator,
+    computed with a shift register rather than :class:`Polynomial`.
+    """
+    table = rs_table(ec_count)
+    remainder = [0] * ec_count
+    for byte in data:
+        row = table[byte ^ remainder[0]]
+        remainder = [a ^ b for a, b in zip(remainder[1:], row)]
+        remainder.append(row[-1])
+    return remainder
+
+
 class Polynomial:
 
     def __init__(self, num, shift):
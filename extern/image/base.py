@@ -1,3 +1,6 @@
+import binascii
+
+
 class BaseImage(object):
     """
     Base QRCode image output class.
@@ -18,6 +21,46 @@ class BaseImage(object):
         """
         raise NotImplementedError("BaseImage.drawrect")
 
+    def draw_modules(self, modules):
+        """
+        Draw every dark module of a :class:`~..matrix.ModuleMatrix`.
+
+        Image classes able to render the whole matrix at once override this
+        rather than :meth:`drawrect`.
+        """
+        width = modules.size
+        cells = modules.cells
+        for i in range(width * width):
+            if cells[i]:
+                self.drawrect(i // width, i % width)
+
+    def scanlines(self, modules):
+        """
+        A helper method for raster image generators that returns every pixel
+        row of the image, border included, as packed 1-bit ``bytes``. Light
+        pixels are set bits and rows are padded to a whole byte, as in PNG
+        greyscale and PIL mode "1" data.
+        """
+        box_size = self.box_size
+        pixels = {0: b'1' * box_size, 1: b'0' * box_size}
+        border = b'1' * (self.border * box_size)
+        padding = b'0' * (-self.pixel_size % 8)
+        hex_width = (self.pixel_size + 7) // 8 * 2
+
+        def pack(bits):
+            return binascii.unhexlify('%0*x' % (hex_width, int(bits, 2)))
+
+        blank = [pack(b'1' * self.pixel_size + padding)] * len(border)
+        lines = list(blank)
+        for row in range(modules.size):
+            line = pack(
+                border +
+                b''.join([pixels[cell] for cell in modules.row_bytes(row)]) +
+                border + padding)
+            lines.extend([line] * box_size)
+        lines.extend(blank)
+        return lines
+
     def save(self, stream, kind=None):
         """
         Save the image file.
@@ -48,3 +48,21 @@ class PilImage(BaseImage):
 
     def __getattr__(self, name):
         return getattr(self._img, name)
+
+
+class PilRasterImage(PilImage):
+    """
+    PIL image builder which renders the whole matrix in one go from packed
+    rows, instead of drawing one rectangle per dark module.
+
+    Only black on white images are rasterized that way, other colors fall
+    back to :meth:`PilImage.drawrect`.
+    """
+
+    def draw_modules(self, modules):
+        if self._img.mode != "1":
+            return super(PilRasterImage, self).draw_modules(modules)
+        self._img = Image.frombytes(
+            "1", (self.pixel_size, self.pixel_size),
+            b''.join(self.scanlines(modules)))
+        self._idr = ImageDraw.Draw(self._img)
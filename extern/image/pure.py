@@ -0,0 +1,70 @@
+import struct
+import zlib
+
+from ..matrix import ModuleMatrix
+from .base import BaseImage
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def png_chunk(tag, data):
+    """
+    Return a PNG chunk: length, tag, data and CRC.
+    """
+    return b''.join([
+        struct.pack('>I', len(data)),
+        tag,
+        data,
+        struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff),
+    ])
+
+
+class PurePngImage(BaseImage):
+    """
+    Dependency-free image builder, writing 1-bit greyscale PNG files with
+    ``zlib`` only.
+
+    Only black modules on a white background are supported.
+    """
+    kind = "PNG"
+    allowed_kinds = ("PNG",)
+
+    def new_image(self, **kwargs):
+        fill_color = kwargs.get("fill_color", "black")
+        back_color = kwargs.get("back_color", "white")
+        if fill_color.lower() != "black" or back_color.lower() != "white":
+            raise ValueError(
+                "%s only supports black on white images" %
+                type(self).__name__)
+        return ModuleMatrix(self.width)
+
+    def drawrect(self, row, col):
+        self._img.set(row, col, True)
+
+    def draw_modules(self, modules):
+        self._img = modules.copy()
+
+    def save(self, stream, format=None, **kwargs):
+        if format is None:
+            format = kwargs.get("kind", self.kind)
+        self.check_kind(format, transform=lambda kind: kind.upper())
+        stream.write(self.to_bytes(**kwargs))
+
+    def to_bytes(self, compress_level=9, **kwargs):
+        """
+        Return the PNG file contents.
+        """
+        header = struct.pack(
+            '>IIBBBBB', self.pixel_size, self.pixel_size,
+            1,  # bit depth
+            0,  # color type: greyscale
+            0,  # compression method: deflate
+            0,  # filter method: adaptive, every row using filter type 0
+            0)  # interlace method: none
+        raw = b''.join([b'\x00' + line for line in self.scanlines(self._img)])
+        return b''.join([
+            PNG_SIGNATURE,
+            png_chunk(b'IHDR', header),
+            png_chunk(b'IDAT', zlib.compress(raw, compress_level)),
+            png_chunk(b'IEND', b''),
+        ])
@@ -0,0 +1,101 @@
+from ..matrix import ModuleMatrix
+from .base import BaseImage
+
+
+class SvgPathImage(BaseImage):
+    """
+    SVG image builder, drawing every dark module with a single ``<path>``.
+
+    Dark modules are merged into as few rectangles as runs allow, and
+    coordinates are expressed in modules so that the file stays small
+    whatever the box size; ``box_size`` only sets the default display size.
+    """
+    kind = "SVG"
+    allowed_kinds = ("SVG",)
+
+    def new_image(self, **kwargs):
+        self.fill_color = kwargs.get("fill_color", "#000")
+        self.back_color = kwargs.get("back_color", "#fff")
+        return ModuleMatrix(self.width)
+
+    def drawrect(self, row, col):
+        self._img.set(row, col, True)
+
+    def draw_modules(self, modules):
+        self._img = modules.copy()
+
+    def path_data(self):
+        """
+        Return the ``d`` attribute of the path.
+
+        Each rectangle is a subpath of relative commands, starting from where
+        the previous one left the pen: ``m dx dy h width v height h -width``.
+        Subpaths are not closed, as filling closes them anyway.
+        """
+        commands = []
+        x = y = 0
+        for top, left, width, height in self.rectangles():
+            commands.append('m%d %dh%dv%dh-%d' % (
+                left + self.border - x, top + self.border - y,
+                width, height, width))
+            x, y = left + self.border, top + self.border + height
+        return ''.join(commands).replace(' -', '-')
+
+    def rectangles(self):
+        """
+        Return the ``(top, left, width, height)`` of rectangles covering the
+        dark modules, sorted from the top left.
+
+        Horizontally adjacent dark modules are merged into runs, and runs
+        spanning the same columns on consecutive rows into one rectangle.
+        """
+        rectangles = []
+        above = {}  # (left, width) -> [top, left, width, height]
+        for row in range(self.width):
+            cells = self._img.row_bytes(row)
+            current = {}
+            col = 0
+            while col < self.width:
+                if not cells[col]:
+                    col += 1
+                    continue
+                start = col
+                while col < self.width and cells[col]:
+                    col += 1
+                run = (start, col - start)
+                rectangle = above.pop(run, None)
+                if rectangle is None:
+                    rectangle = [row, start, col - start, 0]
+                    rectangles.append(rectangle)
+                rectangle[3] += 1
+                current[run] = rectangle
+            above = current
+        return sorted(tuple(rectangle) for rectangle in rectangles)
+
+    def save(self, stream, format=None, **kwargs):
+        if format is None:
+            format = kwargs.get("kind", self.kind)
+        self.check_kind(format, transform=lambda kind: kind.upper())
+        stream.write(self.to_bytes())
+
+    def to_bytes(self):
+        """
+        Return the SVG document, UTF-8 encoded.
+        """
+        size = self.width + self.border * 2
+        background = ''
+        if self.back_color:
+            background = '<rect width="%d" height="%d" fill="%s"/>' % (
+                size, size, self.back_color)
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+            'width="%(pixels)d" height="%(pixels)d" '
+            'viewBox="0 0 %(size)d %(size)d" shape-rendering="crispEdges">'
+            '%(background)s<path fill="%(fill)s" d="%(path)s"/></svg>\n' % {
+                'pixels': self.pixel_size,
+                'size': size,
+                'background': background,
+                'fill': self.fill_color,
+                'path': self.path_data(),
+            }).encode('utf-8')
@@ -1,7 +1,10 @@
 from . import constants, exceptions, util
 from .image.base import BaseImage
+from .matrix import ModuleMatrix, cells_to_int, int_to_cells
 
+import io
 import six
+from array import array
 from bisect import bisect_left
 
 
@@ -23,6 +26,83 @@ def _check_box_size(size):
             "Invalid box size (was %s, expected larger than 0)" % size)
 
 
+# Function pattern templates, shared by every QRCode of the process.
+_templates = {}
+
+
+def function_template(version, test):
+    """
+    Return the cached ``(matrix, data_positions)`` template for a version.
+
+    The matrix holds the finder, alignment, timing and version patterns, and
+    reserves the format information modules (which depend on the error
+    correction level and mask, so callers must write them on their copy).
+    ``data_positions`` lists the flat indices of the remaining data modules
+    in :meth:`QRCode.map_data` traversal order.
+
+    The matrix is shared: never modify it, work on a copy instead.
+    """
+    key = (version, bool(test))
+    template = _templates.get(key)
+    if template is None:
+        qr = QRCode(version=version)
+        qr.modules_count = version * 4 + 17
+        qr.modules = ModuleMatrix(qr.modules_count)
+        qr.setup_function_patterns(test)
+        template = (qr.modules, _data_positions(qr.modules))
+        _templates[key] = template
+    return template
+
+
+# Mask bitplanes, keyed by (version, mask pattern).
+_mask_planes = {}
+
+
+def mask_plane(version, mask_pattern):
+    """
+    Return the cached bitplane of a mask pattern for a version, packed with
+    :func:`~.matrix.cells_to_int`.
+
+    The plane only flips data modules, so XORing it over a whole matrix
+    applies the mask while leaving the function patterns untouched.
+    """
+    key = (version, mask_pattern)
+    plane = _mask_planes.get(key)
+    if plane is None:
+        size = version * 4 + 17
+        mask_func = util.mask_func(mask_pattern)
+        cells = bytearray(size * size)
+        for i in function_template(version, True)[1]:
+            if mask_func(i // size, i % size):
+                cells[i] = 1
+        plane = cells_to_int(cells)
+        _mask_planes[key] = plane
+    return plane
+
+
+def _data_positions(modules):
+    """
+    List the unset modules of a matrix in data placement order: two-module
+    wide columns from right to left, alternately upwards and downwards,
+    skipping the vertical timing pattern column.
+    """
+    size = modules.size
+    reserved = modules.reserved
+    positions = array('H')
+    upwards = True
+    for col in six.moves.xrange(size - 1, 0, -2):
+        if col <= 6:
+            col -= 1
+        rows = six.moves.xrange(size - 1, -1, -1) if upwards else six.moves.xrange(size)
+        for row in rows:
+            for c in (col, col - 1):
+                i = row * size + c
+                if not reserved[i]:
+                    positions.append(i)
+        upwards = not upwards
+    return positions
+
+
 class QRCode:
 
     def __init__(self, version=None,
@@ -49,6 +129,10 @@ class QRCode:
         self.modules_count = 0
         self.data_cache = None
         self.data_list = []
+        # (start, stop, data, version) of each data_list slice holding the
+        # chunks of data added with OPTIMIZE_MINIMAL, for the size class of
+        # version.
+        self.minimal_data = []
 
     def add_data(self, data, optimize=20):
         """
@@ -56,12 +140,21 @@ class QRCode:
 
         :param optimize: Data will be split into multiple chunks to optimize
             the QR size by finding to more compressed modes of at least this
-            length. Set to ``0`` to avoid optimizing at all.
+            length. Set to ``0`` to avoid optimizing at all, or to
+            ``util.OPTIMIZE_MINIMAL`` to use the segmentation with the fewest
+            bits for the size class of ``self.version``. If no version was
+            set, the data is split again once :meth:`best_fit` has found it.
         """
         if isinstance(data, util.QRData):
             self.data_list.append(data)
         else:
-            if optimize:
+            if optimize == util.OPTIMIZE_MINIMAL:
+                version = self.version or 1
+                start = len(self.data_list)
+                self.data_list.extend(util.minimal_data_chunks(data, version))
+                self.minimal_data.append(
+                    (start, len(self.data_list), data, version))
+            elif optimize:
                 self.data_list.extend(util.optimal_data_chunks(data))
             else:
                 self.data_list.append(util.QRData(data))
@@ -81,15 +174,21 @@ class QRCode:
     def makeImpl(self, test, mask_pattern):
         _check_version(self.version)
         self.modules_count = self.version * 4 + 17
-        self.modules = [None] * self.modules_count
-
-        for row in range(self.modules_count):
+        self.modules = function_template(self.version, test)[0].copy()
+        self.setup_type_info(test, mask_pattern)
 
-            self.modules[row] = [None] * self.modules_count
+        if self.data_cache is None:
+            self.data_cache = util.create_data(
+                self.version, self.error_correction, self.data_list)
+        self.map_data(self.data_cache, mask_pattern)
 
-            for col in range(self.modules_count):
-                self.modules[row][col] = None   # (col + row) % 3
+    def setup_function_patterns(self, test, mask_pattern=0):
+        """
+        Draw every function pattern on ``self.modules``.
 
+        :meth:`makeImpl` does not call this directly but copies the cached
+        result from :func:`function_template`.
+        """
         self.setup_position_probe_pattern(0, 0)
         self.setup_position_probe_pattern(self.modules_count - 7, 0)
         self.setup_position_probe_pattern(0, self.modules_count - 7)
@@ -100,11 +199,6 @@ class QRCode:
         if self.version >= 7:
             self.setup_type_number(test)
 
-        if self.data_cache is None:
-            self.data_cache = util.create_data(
-                self.version, self.error_correction, self.data_list)
-        self.map_data(self.data_cache, mask_pattern)
-
     def setup_position_probe_pattern(self, row, col):
         for r in range(-1, 8):
 
@@ -116,31 +210,69 @@ class QRCode:
                 if col + c <= -1 or self.modules_count <= col + c:
                     continue
 
-                if (0 <= r and r <= 6 and (c == 0 or c == 6)
-                        or (0 <= c and c <= 6 and (r == 0 or r == 6))
-                        or (2 <= r and r <= 4 and 2 <= c and c <= 4)):
-                    self.modules[row + r][col + c] = True
-                else:
-                    self.modules[row + r][col + c] = False
+                self.modules.set(
+                    row + r, col + c,
+                    (0 <= r and r <= 6 and (c == 0 or c == 6)
+                     or (0 <= c and c <= 6 and (r == 0 or r == 6))
+                     or (2 <= r and r <= 4 and 2 <= c and c <= 4)))
 
     def best_fit(self, start=None):
         """
         Find the minimum size required to fit in the data.
+
+        Data added with ``util.OPTIMIZE_MINIMAL`` is split again for the size
+        class found (or for the largest codes if it did not fit), and fitted
+        again if that changed its length. The size class can only grow from
+        one pass to the next, so there are at most three of them.
         """
         if start is None:
             start = 1
         _check_version(start)
+        while True:
+            try:
+                self._fit(start)
+            except exceptions.DataOverflowError:
+                if not self.split_minimal_data(40):
+                    raise
+                continue
+            if not self.split_minimal_data(self.version):
+                return self.version
 
-        # Corresponds to the code in util.create_data, except we don't yet know
-        # version, so optimistically assume start and check later
-        mode_sizes = util.mode_sizes_for_version(start)
-        buffer = util.BitBuffer()
-        for data in self.data_list:
-            buffer.put(data.mode, 4)
-            buffer.put(len(data), mode_sizes[data.mode])
-            data.write(buffer)
+    def split_minimal_data(self, version):
+        """
+        Split the data added with ``util.OPTIMIZE_MINIMAL`` again, for the
+        size class of ``version``.
 
-        needed_bits = len(buffer)
+        Return ``True`` if any of it was split for another size class.
+        """
+        mode_sizes = util.mode_sizes_for_version(version)
+        data_list = []
+        minimal_data = []
+        changed = False
+        end = 0
+        for start, stop, data, data_version in self.minimal_data:
+            data_list.extend(self.data_list[end:start])
+            chunks = self.data_list[start:stop]
+            if util.mode_sizes_for_version(data_version) is not mode_sizes:
+                chunks = list(util.minimal_data_chunks(data, version))
+                data_version = version
+                changed = True
+            minimal_data.append((len(data_list), len(data_list) + len(chunks),
+                                 data, data_version))
+            data_list.extend(chunks)
+            end = stop
+        if changed:
+            data_list.extend(self.data_list[end:])
+            self.data_list = data_list
+            self.minimal_data = minimal_data
+            self.data_cache = None
+        return changed
+
+    def _fit(self, start):
+        # Corresponds to the bits written by util.create_data, except we don't
+        # yet know version, so optimistically assume start and check later
+        mode_sizes = util.mode_sizes_for_version(start)
+        needed_bits = sum(data.bit_length(start) for data in self.data_list)
         self.version = bisect_left(util.BIT_LIMIT_TABLE[self.error_correction],
                                    needed_bits, start)
         if self.version == 41:
@@ -149,20 +281,35 @@ class QRCode:
         # Now check whether we need more bits for the mode sizes, recursing if
         # our guess was too low
         if mode_sizes is not util.mode_sizes_for_version(self.version):
-            self.best_fit(start=self.version)
-        return self.version
+            self._fit(self.version)
 
     def best_mask_pattern(self):
         """
         Find the most efficient mask pattern.
+
+        The unmasked data layer is built once, then each candidate is obtained
+        by XORing a precomputed mask bitplane over it.
         """
+        _check_version(self.version)
+        if self.data_cache is None:
+            self.data_cache = util.create_data(
+                self.version, self.error_correction, self.data_list)
+
+        self.modules_count = self.version * 4 + 17
+        self.modules = function_template(self.version, True)[0].copy()
+        self.scatter_data(self.data_cache)
+        length = self.modules_count * self.modules_count
+        layer = cells_to_int(self.modules.cells)
+        reserved = self.modules.reserved
+
         min_lost_point = 0
         pattern = 0
 
         for i in range(8):
-            self.makeImpl(True, i)
+            cells = int_to_cells(layer ^ mask_plane(self.version, i), length)
 
-            lost_point = util.lost_point(self.modules)
+            lost_point = util.lost_point(
+                ModuleMatrix(self.modules_count, cells, reserved))
 
             if i == 0 or min_lost_point > lost_point:
                 min_lost_point = lost_point
@@ -191,7 +338,7 @@ class QRCode:
         for r in range(modcount):
             out.write("\x1b[1;47m  \x1b[40m")
             for c in range(modcount):
-                if self.modules[r][c]:
+                if self.modules.get(r, c):
                     out.write("  ")
                 else:
                     out.write("\x1b[1;47m  \x1b[40m")
@@ -237,7 +384,7 @@ class QRCode:
                 return 1
             if min(x, y) < 0 or max(x, y) >= modcount:
                 return 0
-            return self.modules[x][y]
+            return self.modules.get(x, y)
 
         for r in range(-self.border, modcount+self.border, 2):
             if tty:
@@ -268,27 +415,24 @@ class QRCode:
             image_factory = self.image_factory
             if image_factory is None:
                 # Use PIL by default
-                from .image.pil import PilImage
-                image_factory = PilImage
+                from .image.pil import PilRasterImage
+                image_factory = PilRasterImage
 
         im = image_factory(
             self.border, self.modules_count, self.box_size, **kwargs)
-        for r in range(self.modules_count):
-            for c in range(self.modules_count):
-                if self.modules[r][c]:
-                    im.drawrect(r, c)
+        im.draw_modules(self.modules)
         return im
 
     def setup_timing_pattern(self):
         for r in range(8, self.modules_count - 8):
-            if self.modules[r][6] is not None:
+            if self.modules.is_set(r, 6):
                 continue
-            self.modules[r][6] = (r % 2 == 0)
+            self.modules.set(r, 6, r % 2 == 0)
 
         for c in range(8, self.modules_count - 8):
-            if self.modules[6][c] is not None:
+            if self.modules.is_set(6, c):
                 continue
-            self.modules[6][c] = (c % 2 == 0)
+            self.modules.set(6, c, c % 2 == 0)
 
     def setup_position_adjust_pattern(self):
         pos = util.pattern_position(self.version)
@@ -300,29 +444,28 @@ class QRCode:
                 row = pos[i]
                 col = pos[j]
 
-                if self.modules[row][col] is not None:
+                if self.modules.is_set(row, col):
                     continue
 
                 for r in range(-2, 3):
 
                     for c in range(-2, 3):
 
-                        if (r == -2 or r == 2 or c == -2 or c == 2 or
-                                (r == 0 and c == 0)):
-                            self.modules[row + r][col + c] = True
-                        else:
-                            self.modules[row + r][col + c] = False
+                        self.modules.set(
+                            row + r, col + c,
+                            (r == -2 or r == 2 or c == -2 or c == 2 or
+                             (r == 0 and c == 0)))
 
     def setup_type_number(self, test):
         bits = util.BCH_type_number(self.version)
 
         for i in range(18):
             mod = (not test and ((bits >> i) & 1) == 1)
-            self.modules[i // 3][i % 3 + self.modules_count - 8 - 3] = mod
+            self.modules.set(i // 3, i % 3 + self.modules_count - 8 - 3, mod)
 
         for i in range(18):
             mod = (not test and ((bits >> i) & 1) == 1)
-            self.modules[i % 3 + self.modules_count - 8 - 3][i // 3] = mod
+            self.modules.set(i % 3 + self.modules_count - 8 - 3, i // 3, mod)
 
     def setup_type_info(self, test, mask_pattern):
         data = (self.error_correction << 3) | mask_pattern
@@ -334,11 +477,11 @@ class QRCode:
             mod = (not test and ((bits >> i) & 1) == 1)
 
             if i < 6:
-                self.modules[i][8] = mod
+                self.modules.set(i, 8, mod)
             elif i < 8:
-                self.modules[i + 1][8] = mod
+                self.modules.set(i + 1, 8, mod)
             else:
-                self.modules[self.modules_count - 15 + i][8] = mod
+                self.modules.set(self.modules_count - 15 + i, 8, mod)
 
         # horizontal
         for i in range(15):
@@ -346,59 +489,36 @@ class QRCode:
             mod = (not test and ((bits >> i) & 1) == 1)
 
             if i < 8:
-                self.modules[8][self.modules_count - i - 1] = mod
+                self.modules.set(8, self.modules_count - i - 1, mod)
             elif i < 9:
-                self.modules[8][15 - i - 1 + 1] = mod
+                self.modules.set(8, 15 - i - 1 + 1, mod)
             else:
-                self.modules[8][15 - i - 1] = mod
+                self.modules.set(8, 15 - i - 1, mod)
 
         # fixed module
-        self.modules[self.modules_count - 8][8] = (not test)
+        self.modules.set(self.modules_count - 8, 8, not test)
 
     def map_data(self, data, mask_pattern):
-        inc = -1
-        row = self.modules_count - 1
-        bitIndex = 7
-        byteIndex = 0
-
-        mask_func = util.mask_func(mask_pattern)
-
-        data_len = len(data)
-
-        for col in six.moves.xrange(self.modules_count - 1, 0, -2):
-
-            if col <= 6:
-                col -= 1
-
-            col_range = (col, col-1)
-
-            while True:
-
-                for c in col_range:
-
-                    if self.modules[row][c] is None:
-
-                        dark = False
-
-                        if byteIndex < data_len:
-                            dark = (((data[byteIndex] >> bitIndex) & 1) == 1)
-
-                        if mask_func(row, c):
-                            dark = not dark
-
-                        self.modules[row][c] = dark
-                        bitIndex -= 1
-
-                        if bitIndex == -1:
-                            byteIndex += 1
-                            bitIndex = 7
+        """
+        Place the codewords over the free modules and apply the mask.
+        """
+        self.scatter_data(data)
+        modules = self.modules
+        modules.cells[:] = int_to_cells(
+            cells_to_int(modules.cells) ^ mask_plane(self.version, mask_pattern),
+            len(modules.cells))
 
-                row += inc
+    def scatter_data(self, data):
+        """
+        Place the unmasked codeword bits over the free modules.
+        """
+        cells = self.modules.cells
+        positions = function_template(self.version, True)[1]
+        bits = util.data_bits(data, len(positions))
 
-                if row < 0 or self.modules_count <= row:
-                    row -= inc
-                    inc = -inc
-                    break
+        for i, dark in zip(positions, bits):
+            cells[i] = dark
+        self.modules.reserved[:] = b'\x01' * len(cells)
 
     def get_matrix(self):
         """
@@ -410,13 +530,83 @@ class QRCode:
             self.make()
 
         if not self.border:
-            return self.modules
+            return self.modules.to_list()
 
         width = len(self.modules) + self.border*2
         code = [[False]*width] * self.border
         x_border = [False]*self.border
-        for module in self.modules:
+        for module in self.modules.to_list():
             code.append(x_border + module + x_border)
         code += [[False]*width] * self.border
 
         return code
+
+
+class QRBatchEncoder(object):
+    """
+    Encode many payloads with the same settings.
+
+    Function pattern templates, Reed-Solomon tables and mask bitplanes are
+    process-wide caches, so they are only built by the first code of each
+    version. On top of that, the encoder reuses a single :class:`QRCode` and
+    only renders identical payloads once per call.
+
+    Keyword arguments are those of :class:`QRCode`, plus ``optimize`` which
+    is passed to :meth:`QRCode.add_data`.
+    """
+
+    def __init__(self, optimize=20, **kwargs):
+        self.optimize = optimize
+        self.qr = QRCode(**kwargs)
+        self.version = self.qr.version
+
+    def make(self, data):
+        """
+        Compile a payload, returning the (reused) :class:`QRCode`.
+        """
+        qr = self.qr
+        qr.clear()
+        qr.version = self.version
+        qr.add_data(data, optimize=self.optimize)
+        qr.make()
+        return qr
+
+    def encode_matrix(self, data):
+        """
+        Return the :class:`~.matrix.ModuleMatrix` of a payload.
+        """
+        return self.make(data).modules
+
+    def encode_image(self, data, **kwargs):
+        """
+        Return the saved image file contents of a payload.
+
+        Keyword arguments are passed to :meth:`QRCode.make_image`.
+        """
+        im = self.make(data).make_image(**kwargs)
+        with io.BytesIO() as output:
+            im.save(output)
+            return output.getvalue()
+
+    def encode_matrices(self, iterable):
+        """
+        Return the list of matrices of the payloads in ``iterable``.
+        """
+        return self._encode_all(self.encode_matrix, iterable, {})
+
+    def encode_images(self, iterable, **kwargs):
+        """
+        Return the list of image file contents of the payloads in
+        ``iterable``.
+        """
+        return self._encode_all(self.encode_image, iterable, kwargs)
+
+    def _encode_all(self, encode, iterable, kwargs):
+        done = {}
+        results = []
+        for data in iterable:
+            if data not in done:
+                done[data] = encode(data, **kwargs)
+            results.append(done[data])
+        return results
+
@@ -0,0 +1,107 @@
+import binascii
+
+
+class ModuleMatrix(object):
+    """
+    Square QR Code module matrix stored as flat byte arrays.
+
+    ``cells`` holds one byte per module (``1`` for dark, ``0`` for light) in
+    row-major order. ``reserved`` flags the modules which have been assigned
+    so far, which stands for the ``None`` entries of the historical
+    list-of-lists representation.
+    """
+
+    def __init__(self, size, cells=None, reserved=None):
+        self.size = size
+        if cells is None:
+            cells = bytearray(size * size)
+        if reserved is None:
+            reserved = bytearray(size * size)
+        self.cells = cells
+        self.reserved = reserved
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, row):
+        """
+        Return a row as a list of booleans (``None`` for unset modules), for
+        code written against the list-of-lists representation.
+        """
+        if row < 0:
+            row += self.size
+        start = row * self.size
+        cells = self.cells
+        reserved = self.reserved
+        return [
+            (cells[i] == 1) if reserved[i] else None
+            for i in range(start, start + self.size)]
+
+    def __iter__(self):
+        for row in range(self.size):
+            yield self[row]
+
+    def index(self, row, col):
+        return row * self.size + col
+
+    def get(self, row, col):
+        return self.cells[row * self.size + col] == 1
+
+    def is_set(self, row, col):
+        return self.reserved[row * self.size + col] == 1
+
+    def set(self, row, col, dark):
+        i = row * self.size + col
+        self.cells[i] = 1 if dark else 0
+        self.reserved[i] = 1
+
+    def row_bytes(self, row):
+        """
+        Return the cells of a row as a ``bytearray`` of ``0``/``1`` values.
+        """
+        start = row * self.size
+        return self.cells[start:start + self.size]
+
+    def copy(self):
+        return ModuleMatrix(
+            self.size, bytearray(self.cells), bytearray(self.reserved))
+
+    def to_list(self):
+        """
+        Return the matrix as a list of lists of booleans.
+        """
+        return [self[row] for row in range(self.size)]
+
+    @classmethod
+    def from_list(cls, modules):
+        """
+        Build a matrix from a list of lists of booleans (or ``None``).
+        """
+        size = len(modules)
+        matrix = cls(size)
+        cells = matrix.cells
+        reserved = matrix.reserved
+        i = 0
+        for row in modules:
+            for value in row:
+                if value is not None:
+                    reserved[i] = 1
+                    if value:
+                        cells[i] = 1
+                i += 1
+        return matrix
+
+
+def cells_to_int(cells):
+    """
+    Pack a ``bytearray`` of cells into a single integer, so that whole
+    matrices can be combined with one bitwise operation.
+    """
+    return int(binascii.hexlify(cells), 16)
+
+
+def int_to_cells(value, length):
+    """
+    Unpack an integer built by :func:`cells_to_int` into ``length`` cells.
+    """
+    return bytearray(binascii.unhexlify('%0*x' % (length * 2, value)))
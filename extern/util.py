@@ -1,10 +1,17 @@
 import re
 import math
+import binascii
 
 import six
 from six.moves import xrange
 
 from . import base, exceptions
+from .matrix import ModuleMatrix
+
+# NumPy is optional, it only speeds up the penalty scoring. It takes a while to
+# import, so this is left to the first lost_point() call, see _import_numpy().
+numpy = None
+_numpy_imported = False
 
 # QR encoding modes.
 MODE_NUMBER = 1 << 0
@@ -173,134 +180,167 @@ def length_in_bits(mode, version):
 
 
 def lost_point(modules):
-    modules_count = len(modules)
+    """
+    Compute the penalty score of a module matrix.
 
-    lost_point = 0
+    :param modules: a :class:`~.matrix.ModuleMatrix`, or a list of lists of
+        booleans.
+    """
+    if not isinstance(modules, ModuleMatrix):
+        modules = ModuleMatrix.from_list(modules)
 
-    lost_point = _lost_point_level1(modules, modules_count)
-    lost_point += _lost_point_level2(modules, modules_count)
-    lost_point += _lost_point_level3(modules, modules_count)
-    lost_point += _lost_point_level4(modules, modules_count)
+    if _import_numpy() is not None:
+        return _lost_point_numpy(modules)
+    return _lost_point_python(modules)
 
-    return lost_point
 
+def _import_numpy():
+    """
+    Import NumPy on first use, returning the module, or ``None`` if it is not
+    installed.
+    """
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        try:
+            import numpy
+        except ImportError:  # pragma: no cover
+            numpy = None
+        _numpy_imported = True
+    return numpy
 
-def _lost_point_level1(modules, modules_count):
-    lost_point = 0
 
-    modules_range = xrange(modules_count)
-    row_range_first = (0, 1)
-    row_range_last = (-1, 0)
-    row_range_standard = (-1, 0, 1)
+def _lost_point_python(modules):
+    modules_count = modules.size
+    rows = [modules.row_bytes(row) for row in xrange(modules_count)]
 
-    col_range_first = ((0, 1), (1,))
-    col_range_last = ((-1, 0), (-1,))
-    col_range_standard = ((-1, 0, 1), (-1, 1))
+    lost_point = _lost_point_level1(rows, modules_count)
+    lost_point += _lost_point_level2(rows, modules_count)
+    lost_point += _lost_point_level3(modules.cells, modules_count)
+    lost_point += _lost_point_level4(modules.cells, modules_count)
 
-    for row in modules_range:
+    return lost_point
 
-        if row == 0:
-            row_range = row_range_first
-        elif row == modules_count-1:
-            row_range = row_range_last
-        else:
-            row_range = row_range_standard
 
-        for col in modules_range:
+def _lost_point_numpy(modules):
+    """
+    NumPy implementation of :func:`lost_point`, returning the same scores as
+    the pure Python one.
+    """
+    numpy = _import_numpy()
+    modules_count = modules.size
+    cells = modules.cells
+    m = numpy.frombuffer(bytes(cells), dtype=numpy.uint8).reshape(
+        modules_count, modules_count).astype(numpy.int16)
+
+    # Level 1: same-colored neighbours, from 3x3 box sums of the dark modules
+    # and of the in-bounds positions.
+    def box_sums(a):
+        padded = numpy.pad(a, 1, 'constant')
+        return sum(
+            padded[r:r + modules_count, c:c + modules_count]
+            for r in (0, 1, 2) for c in (0, 1, 2))
+
+    dark_neighbours = box_sums(m) - m
+    neighbours = box_sums(numpy.ones_like(m)) - 1
+    same = numpy.where(m == 1, dark_neighbours, neighbours - dark_neighbours)
+    lost_point = int((same[same > 5] - 2).sum())
+
+    # Level 2: 2x2 blocks of a single color.
+    blocks = m[:-1, :-1] + m[1:, :-1] + m[:-1, 1:] + m[1:, 1:]
+    lost_point += 3 * int(numpy.count_nonzero((blocks == 0) | (blocks == 4)))
+
+    # Level 3: 1:1:3:1:1 finder-like runs, in rows then columns.
+    dark = m.astype(bool)
+    for a in (dark, dark.T):
+        w = modules_count - 6
+        runs = (a[:, 0:w] & ~a[:, 1:w + 1] & a[:, 2:w + 2] & a[:, 3:w + 3] &
+                a[:, 4:w + 4] & ~a[:, 5:w + 5] & a[:, 6:w + 6])
+        lost_point += 40 * int(numpy.count_nonzero(runs))
+
+    lost_point += _lost_point_level4(cells, modules_count)
 
-            sameCount = 0
-            dark = modules[row][col]
+    return lost_point
 
-            if col == 0:
-                col_range = col_range_first
-            elif col == modules_count-1:
-                col_range = col_range_last
-            else:
-                col_range = col_range_standard
 
-            for r in row_range:
+def _lost_point_level1(rows, modules_count):
+    """
+    Penalise modules having more than five same-colored neighbours.
 
-                row_offset = row + r
+    The dark neighbours of each module are counted with 3x3 box sums, light
+    neighbours being the remainder of the in-bounds neighbourhood.
+    """
+    lost_point = 0
 
-                if r != 0:
-                    col_idx = 0
+    # Horizontal sums over (col - 1, col, col + 1), clipped to the matrix.
+    hsums = []
+    for row in rows:
+        hsums.append(
+            [row[0] + row[1]] +
+            [a + b + c for a, b, c in zip(row, row[1:], row[2:])] +
+            [row[-2] + row[-1]])
+
+    last = modules_count - 1
+    for r in xrange(modules_count):
+        row = rows[r]
+        if r == 0:
+            boxes = [a + b for a, b in zip(hsums[0], hsums[1])]
+            height = 2
+        elif r == last:
+            boxes = [a + b for a, b in zip(hsums[r - 1], hsums[r])]
+            height = 2
+        else:
+            boxes = [a + b + c for a, b, c in
+                     zip(hsums[r - 1], hsums[r], hsums[r + 1])]
+            height = 3
+        # Number of in-bounds neighbours for inner and edge columns.
+        inner = height * 3 - 1
+        edge = height * 2 - 1
+        for c in xrange(modules_count):
+            dark = row[c]
+            same = boxes[c] - dark
+            if not dark:
+                if c == 0 or c == last:
+                    same = edge - same
                 else:
-                    col_idx = 1
-
-                for c in col_range[col_idx]:
-
-                    if dark == modules[row_offset][col + c]:
-                        sameCount += 1
-
-            if sameCount > 5:
-                lost_point += (3 + sameCount - 5)
+                    same = inner - same
+            if same > 5:
+                lost_point += (3 + same - 5)
 
     return lost_point
 
 
-def _lost_point_level2(modules, modules_count):
+def _lost_point_level2(rows, modules_count):
     lost_point = 0
 
-    modules_range = xrange(modules_count - 1)
-
-    for row in modules_range:
-        this_row = modules[row]
-        next_row = modules[row+1]
-        for col in modules_range:
-            count = 0
-            if this_row[col]:
-                count += 1
-            if next_row[col]:
-                count += 1
-            if this_row[col + 1]:
-                count += 1
-            if next_row[col + 1]:
-                count += 1
+    pairs = [[a + b for a, b in zip(row, row[1:])] for row in rows]
+    for this_pairs, next_pairs in zip(pairs, pairs[1:]):
+        for a, b in zip(this_pairs, next_pairs):
+            count = a + b
             if count == 0 or count == 4:
                 lost_point += 3
 
     return lost_point
 
 
-def _lost_point_level3(modules, modules_count):
-    modules_range_short = xrange(modules_count-6)
+# Dark-light-dark-dark-dark-light-dark finder-like run, allowing overlaps.
+RE_FINDER_LIKE = re.compile(six.b('(?=\x01\x00\x01\x01\x01\x00\x01)'))
 
-    lost_point = 0
-    for row in xrange(modules_count):
-        this_row = modules[row]
-        for col in modules_range_short:
-            if (this_row[col]
-                    and not this_row[col + 1]
-                    and this_row[col + 2]
-                    and this_row[col + 3]
-                    and this_row[col + 4]
-                    and not this_row[col + 5]
-                    and this_row[col + 6]):
-                lost_point += 40
-
-    for col in xrange(modules_count):
-        for row in modules_range_short:
-            if (modules[row][col]
-                    and not modules[row + 1][col]
-                    and modules[row + 2][col]
-                    and modules[row + 3][col]
-                    and modules[row + 4][col]
-                    and not modules[row + 5][col]
-                    and modules[row + 6][col]):
-                lost_point += 40
 
-    return lost_point
+def _lost_point_level3(cells, modules_count):
+    # Rows and columns are joined with a separator byte so that a match can
+    # not straddle two lines.
+    separator = six.b('\x02')
+    lines = separator.join(
+        bytes(cells[i:i + modules_count])
+        for i in xrange(0, modules_count * modules_count, modules_count))
+    lines += separator + separator.join(
+        bytes(cells[col::modules_count]) for col in xrange(modules_count))
 
+    return 40 * len(RE_FINDER_LIKE.findall(lines))
 
-def _lost_point_level4(modules, modules_count):
-    modules_range = xrange(modules_count)
-    dark_count = 0
 
-    for row in modules_range:
-        this_row = modules[row]
-        for col in modules_range:
-            if this_row[col]:
-                dark_count += 1
+def _lost_point_level4(cells, modules_count):
+    dark_count = sum(cells)
 
     ratio = abs(100 * dark_count / modules_count / modules_count - 50) / 5
     return ratio * 10
@@ -345,6 +385,85 @@ def _optimal_split(data, pattern):
         yield False, data
 
 
+# Value accepted by ``QRCode.add_data(optimize=...)`` to request the
+# segmentation of minimal length from minimal_data_chunks().
+OPTIMIZE_MINIMAL = 'minimal'
+
+# Cost of one character in each mode, in sixths of a bit.
+_CHAR_COSTS = (
+    (MODE_NUMBER, 20),
+    (MODE_ALPHA_NUM, 33),
+    (MODE_8BIT_BYTE, 48),
+)
+_NUMBER_BYTES = frozenset(six.iterbytes(six.b('0123456789')))
+_ALPHA_NUM_BYTES = frozenset(six.iterbytes(ALPHA_NUM))
+
+
+def minimal_data_chunks(data, version=1):
+    """
+    An iterator returning the QRData chunks which encode the data in the
+    fewest bits, for codes in the size class of ``version``.
+
+    This runs a single dynamic programming pass over the data, tracking the
+    cheapest encoding which ends in each mode after every character. Costs
+    are counted in sixths of a bit, so that numeric (10 bits per 3 digits)
+    and alphanumeric (11 bits per 2 characters) runs are exact once rounded
+    up at a segment boundary.
+    """
+    data = to_bytestring(data)
+    if not data:
+        return
+    mode_sizes = mode_sizes_for_version(version)
+    headers = [(4 + mode_sizes[mode]) * 6 for mode, cost in _CHAR_COSTS]
+    infinity = float('inf')
+
+    # costs[m] is the cheapest encoding of the data read so far ending with
+    # a segment of mode m, sources[i][m] the mode of character i - 1 on it.
+    costs = [0, 0, 0]
+    sources = []
+    first = True
+    for byte in six.iterbytes(data):
+        allowed = (
+            byte in _NUMBER_BYTES, byte in _ALPHA_NUM_BYTES, True)
+        # Closing a segment rounds its length up to a whole bit.
+        closed = [-(-cost // 6) * 6 for cost in costs]
+        new_costs = []
+        source = []
+        for m, (mode, char_cost) in enumerate(_CHAR_COSTS):
+            if not allowed[m]:
+                new_costs.append(infinity)
+                source.append(None)
+                continue
+            if first:
+                best, best_source = headers[m], None
+            else:
+                best, best_source = costs[m], m
+                for p in (0, 1, 2):
+                    if p != m and closed[p] + headers[m] < best:
+                        best, best_source = closed[p] + headers[m], p
+            new_costs.append(best + char_cost)
+            source.append(best_source)
+        costs = new_costs
+        sources.append(source)
+        first = False
+
+    # Walk back from the cheapest final mode to find the mode of each byte.
+    m = min((0, 1, 2), key=lambda i: costs[i])
+    modes = []
+    for source in reversed(sources):
+        modes.append(m)
+        m = source[m]
+    modes.reverse()
+
+    start = 0
+    for i in xrange(1, len(data) + 1):
+        if i == len(data) or modes[i] != modes[start]:
+            yield QRData(
+                data[start:i], mode=_CHAR_COSTS[modes[start]][0],
+                check_data=False)
+            start = i
+
+
 def to_bytestring(data):
     """
     Convert data to a (utf-8 encoded) byte-string if it isn't a byte-string
@@ -393,69 +512,161 @@ class QRData:
                     "{0}".format(mode))
 
         self.data = data
+        self._encoded = None
 
     def __len__(self):
         return len(self.data)
 
-    def write(self, buffer):
+    def payload_length(self):
+        """
+        Number of bits of the encoded data, excluding the mode and length
+        headers.
+        """
+        count = len(self.data)
         if self.mode == MODE_NUMBER:
-            for i in xrange(0, len(self.data), 3):
-                chars = self.data[i:i + 3]
-                bit_length = NUMBER_LENGTH[len(chars)]
-                buffer.put(int(chars), bit_length)
+            remainder = count % 3
+            return (count // 3) * 10 + (
+                NUMBER_LENGTH[remainder] if remainder else 0)
         elif self.mode == MODE_ALPHA_NUM:
-            for i in xrange(0, len(self.data), 2):
-                chars = self.data[i:i + 2]
-                if len(chars) > 1:
-                    buffer.put(
-                        ALPHA_NUM.find(chars[0]) * 45 +
-                        ALPHA_NUM.find(chars[1]), 11)
-                else:
-                    buffer.put(ALPHA_NUM.find(chars), 6)
+            return (count // 2) * 11 + (count % 2) * 6
+        return count * 8
+
+    def bit_length(self, version):
+        """
+        Number of bits this segment takes in a code of the given version,
+        headers included.
+        """
+        return (4 + length_in_bits(self.mode, version) +
+                self.payload_length())
+
+    def encoded(self):
+        """
+        Return the encoded data bits as a single integer, computed once.
+        """
+        if self._encoded is None:
+            value = 0
+            if self.mode == MODE_NUMBER:
+                for i in xrange(0, len(self.data), 3):
+                    chars = self.data[i:i + 3]
+                    value = (value << NUMBER_LENGTH[len(chars)]) | int(chars)
+            elif self.mode == MODE_ALPHA_NUM:
+                for i in xrange(0, len(self.data), 2):
+                    chars = self.data[i:i + 2]
+                    if len(chars) > 1:
+                        value = (value << 11) | (
+                            ALPHA_NUM.find(chars[0]) * 45 +
+                            ALPHA_NUM.find(chars[1]))
+                    else:
+                        value = (value << 6) | ALPHA_NUM.find(chars)
+            elif self.data:
+                value = int(binascii.hexlify(self.data), 16)
+            self._encoded = value
+        return self._encoded
+
+    def write(self, buffer):
+        if self.mode == MODE_8BIT_BYTE:
+            buffer.put_bytes(self.data)
         else:
-            if six.PY3:
-                # Iterating a bytestring in Python 3 returns an integer,
-                # no need to ord().
-                data = self.data
-            else:
-                data = [ord(c) for c in self.data]
-            for c in data:
-                buffer.put(c, 8)
+            buffer.put(self.encoded(), self.payload_length())
 
     def __repr__(self):
         return repr(self.data)
 
 
 class BitBuffer:
+    """
+    Append-only bit string.
+
+    Whole bytes are stored in a ``bytearray``, while the trailing bits of an
+    incomplete byte are kept in an integer until the next byte boundary.
+    """
 
     def __init__(self):
-        self.buffer = []
+        self.data = bytearray()
         self.length = 0
+        self._pending = 0
+        self._pending_length = 0
 
     def __repr__(self):
         return ".".join([str(n) for n in self.buffer])
 
+    @property
+    def buffer(self):
+        """
+        The bytes written so far, an incomplete last byte being padded with
+        zero bits.
+        """
+        if not self._pending_length:
+            return self.data
+        return self.data + bytearray(
+            [self._pending << (8 - self._pending_length)])
+
+    def getbuffer(self):
+        """
+        Return a ``memoryview`` of the whole bytes written so far, without
+        copying them.
+        """
+        return memoryview(self.data)
+
     def get(self, index):
-        buf_index = math.floor(index / 8)
+        buf_index = index // 8
         return ((self.buffer[buf_index] >> (7 - index % 8)) & 1) == 1
 
     def put(self, num, length):
-        for i in range(length):
-            self.put_bit(((num >> (length - i - 1)) & 1) == 1)
+        num &= (1 << length) - 1
+        self.length += length
+        length += self._pending_length
+        num |= self._pending << (length - self._pending_length)
+        pending_length = length % 8
+        whole = length // 8
+        if whole == 1:
+            self.data.append(num >> pending_length)
+        elif whole:
+            self.data.extend(binascii.unhexlify(
+                '%0*x' % (whole * 2, num >> pending_length)))
+        self._pending = num & ((1 << pending_length) - 1)
+        self._pending_length = pending_length
+
+    def put_bytes(self, data):
+        """
+        Append whole bytes, a ``bytes`` or ``bytearray``.
+        """
+        if not data:
+            return
+        if self._pending_length:
+            self.put(int(binascii.hexlify(data), 16), len(data) * 8)
+        else:
+            self.data.extend(data)
+            self.length += len(data) * 8
 
     def __len__(self):
         return self.length
 
     def put_bit(self, bit):
-        buf_index = self.length // 8
-        if len(self.buffer) <= buf_index:
-            self.buffer.append(0)
-        if bit:
-            self.buffer[buf_index] |= (0x80 >> (self.length % 8))
-        self.length += 1
+        self.put(1 if bit else 0, 1)
+
+
+# The eight bits of every byte value, most significant first.
+BYTE_BITS = [
+    bytearray((value >> shift) & 1 for shift in xrange(7, -1, -1))
+    for value in xrange(256)]
+
+
+def data_bits(data, count):
+    """
+    Unpack codewords into a ``bytearray`` of ``count`` bit values, truncating
+    or padding with zeroes (light modules) as needed.
+    """
+    bits = bytearray().join(BYTE_BITS[byte] for byte in data)
+    if len(bits) < count:
+        bits.extend(bytearray(count - len(bits)))
+    else:
+        del bits[count:]
+    return bits
 
 
 def create_bytes(buffer, rs_blocks):
+    view = buffer.getbuffer()
     offset = 0
 
     maxDcCount = 0
@@ -472,27 +683,10 @@ def create_bytes(buffer, rs_blocks):
         maxDcCount = max(maxDcCount, dcCount)
         maxEcCount = max(maxEcCount, ecCount)
 
-        dcdata[r] = [0] * dcCount
-
-        for i in range(len(dcdata[r])):
-            dcdata[r][i] = 0xff & buffer.buffer[i + offset]
+        dcdata[r] = bytearray(view[offset:offset + dcCount])
         offset += dcCount
 
-        # Get error correction polynomial.
-        rsPoly = base.Polynomial([1], 0)
-        for i in range(ecCount):
-            rsPoly = rsPoly * base.Polynomial([1, base.gexp(i)], 0)
-
-        rawPoly = base.Polynomial(dcdata[r], len(rsPoly) - 1)
-
-        modPoly = rawPoly % rsPoly
-        ecdata[r] = [0] * (len(rsPoly) - 1)
-        for i in range(len(ecdata[r])):
-            modIndex = i + len(modPoly) - len(ecdata[r])
-            if (modIndex >= 0):
-                ecdata[r][i] = modPoly[modIndex]
-            else:
-                ecdata[r][i] = 0
+        ecdata[r] = base.rs_encode(dcdata[r], ecCount)
 
     totalCodeCount = 0
     for rs_block in rs_blocks:
@@ -536,21 +730,16 @@ def create_data(version, error_correction, data_list):
             (len(buffer), bit_limit))
 
     # Terminate the bits (add up to four 0s).
-    for i in range(min(bit_limit - len(buffer), 4)):
-        buffer.put_bit(False)
+    buffer.put(0, min(bit_limit - len(buffer), 4))
 
     # Delimit the string into 8-bit words, padding with 0s if necessary.
     delimit = len(buffer) % 8
     if delimit:
-        for i in range(8 - delimit):
-            buffer.put_bit(False)
+        buffer.put(0, 8 - delimit)
 
     # Add special alternating padding bitstrings until buffer is full.
     bytes_to_fill = (bit_limit - len(buffer)) // 8
-    for i in range(bytes_to_fill):
-        if i % 2 == 0:
-            buffer.put(PAD0, 8)
-        else:
-            buffer.put(PAD1, 8)
+    buffer.put_bytes(
+        (bytearray([PAD0, PAD1]) * ((bytes_to_fill + 1) // 2))[:bytes_to_fill])
 
     return create_bytes(buffer, rs_blocks)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import hashlib
+import os
+import time
+
+from calibre_plugins.qrcode_tracker_philidel.atomicwrite import write_atomically
+
+
+class QrImageCache(object):
+    """
+    Persistent, content-addressed store of encoded QR images
+
+    Each image is a file named after the hash of everything affecting its contents.
+    Hits refresh the file modification time, and ``evict()`` deletes the least recently
+    used files until at most ``max_entries`` are left. Images are a few hundred bytes, less
+    than a filesystem block, so it is the number of files that sets the space used on disk.
+    """
+
+    def __init__(self, directory, max_entries):
+        """Store cache location and size cap (in number of images)"""
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.added = 0
+
+    @staticmethod
+    def key(text, error_correction, box_size, border, image_format):
+        """Return the cache key of a QR image"""
+        digest = hashlib.sha1()
+        digest.update('{0}\0{1}\0{2}\0{3}\0'.format(error_correction, box_size, border, image_format).encode('utf-8'))
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        """Return the file path of an entry"""
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the cached image contents, or None"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store image contents, unless the entry exists already (same key, same contents)"""
+        if write_atomically(self.path(key), data, replace=False):
+            self.added += 1
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in its size cap, if entries were added"""
+        if not self.added:
+            return
+        self.added = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if name.endswith('.tmp') and mtime < time.time() - 3600:
+                entries.append((0, path))  # leftover of an interrupted write
+            else:
+                entries.append((mtime, path))
+        entries.sort()
+        total = len(entries)
+        for mtime, path in entries:
+            if total <= self.max_entries and mtime > 0:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= 1
@@ -6,12 +6,8 @@ __license__ = 'GPL v3'
 __copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
 __docformat__ = 'restructuredtext en'
 
-from copy import deepcopy
 from datetime import datetime
-import sys
-if sys.version_info[0] == 2:
-    from future_builtins import map
-import io
+from functools import partial
 from lxml import etree
 import os
 from PyQt5.Qt import (
@@ -40,8 +36,6 @@ from calibre.gui2.tweak_book.plugin import (
     Tool)  # base class for all tools
 from calibre.gui2.tweak_book.polish import (
     show_report)
-from calibre.gui2.tweak_book.widgets import (
-    BusyCursor)
 from calibre.utils.config import (
     JSONConfig)
 
@@ -49,7 +43,16 @@ from calibre.utils.config import (
 """Import packages local to this plugin"""
 try:
     # from calibre_plugins.qrcode_tracker_philidel.extern import six
-    from calibre_plugins.qrcode_tracker_philidel.extern.main import QRCode
+    from calibre_plugins.qrcode_tracker_philidel.analysis import ChapterAnalysis
+    from calibre_plugins.qrcode_tracker_philidel.changeset import ContainerChangeset
+    from calibre_plugins.qrcode_tracker_philidel.classifier import ChapterModel, FeatureCache, extract_features
+    from calibre_plugins.qrcode_tracker_philidel.extern.main import QRBatchEncoder
+    from calibre_plugins.qrcode_tracker_philidel.imagecache import QrImageCache
+    from calibre_plugins.qrcode_tracker_philidel.profiling import RunProfiler
+    from calibre_plugins.qrcode_tracker_philidel.timing import NULL_TIMER, StageTimer
+    from calibre_plugins.qrcode_tracker_philidel.worker import Canceled, ProgressRunner
+    from calibre_plugins.qrcode_tracker_philidel.extern.image.pure import PurePngImage
+    from calibre_plugins.qrcode_tracker_philidel.extern.image.svg import SvgPathImage
 except ImportError as e:
     import traceback
     print(traceback.format_exc())
@@ -88,8 +91,33 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
 
     title_headings_list = ('h1', 'h2', 'h3', 'h4')
 
+    # number of chapters changed between two progress dialog refreshes
+    apply_batch_size = 10
+
+    # attribute of the tracker element holding the hash of its QR image (see qr_hash)
+    qr_hash_attribute = 'data-qrtracker-hash'
+
     toolbar_checkbox_ref = None
 
+    # toggle switch profiling the next run, see RunProfiler
+    profile_next_run = False
+    profile_checkbox_ref = None
+
+    # ChapterAnalysis of each document, by name, while process_files() runs
+    chapter_analyses = None
+
+    # ContainerChangeset collecting images to remove and add, while process_files() runs
+    changeset = None
+
+    # FeatureCache, while analyse_chapters() runs
+    feature_cache = None
+
+    # StageTimer of the current run, a do-nothing NullTimer unless timing is enabled
+    timer = NULL_TIMER
+
+    # True while dispatcher() runs, as the GUI event loop keeps turning meanwhile
+    running = False
+
     def __init__(self):
         """Initialize plugin preferences"""
         # Default settings {{{
@@ -100,6 +128,12 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
         d['node_element_tagname'] = 'aside'
         d['node_element_type'] = None   # epub:type attribute
         d['imagepath_fmt'] = "filidelqr-{pagename_noext}.png"
+        d['image_format'] = 'png'  # 'png' or 'svg', replaces the imagepath_fmt extension
+        d['image_cache_size'] = 2000  # encoded images kept across runs, 0 to disable
+        d['incremental'] = True  # leave chapters whose QR image is up to date untouched
+        d['chapter_model'] = {}  # weights overriding ChapterModel.DEFAULT_WEIGHTS
+        d['feature_cache_size'] = 10000  # chapter features kept across runs, 0 to disable
+        d['timing'] = False  # report the time spent in each stage, always on in debug mode
         # }}}
 
 
@@ -119,6 +153,10 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
             checked_menu_item.setCheckable(True)
             checked_menu_item.setChecked(self.act_on_current)
             self.toolbar_checkbox_ref = checked_menu_item
+            profile_menu_item = menu.addAction(_('Profile next run'), self.toggle_profile_next_run)
+            profile_menu_item.setCheckable(True)
+            profile_menu_item.setChecked(self.profile_next_run)
+            self.profile_checkbox_ref = profile_menu_item
             self.plugin_ui_refresh()
         ac.triggered.connect(self.dispatcher)
         return ac
@@ -135,12 +173,24 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
         # self.save_prefs()
 
 
+    def toggle_profile_next_run(self):
+        """
+        Uncheck, or check, the 'profile next run' menu item flag
+
+        Called by toolbar menu action.
+        """
+        self.profile_next_run = not self.profile_next_run
+        self.plugin_ui_refresh()
+
+
     def plugin_ui_refresh(self):
         """Change plugin-related UI elements based on context, such as menu item labels"""
         if self.toolbar_checkbox_ref is not None:
             self.toolbar_checkbox_ref.setText(_('Add QR only to active file in editor [enabled]')
                                               if self.act_on_current
                                               else _('Add QR only to active file in editor [disabled]'))
+        if self.profile_checkbox_ref is not None:
+            self.profile_checkbox_ref.setChecked(self.profile_next_run)
 
 
     @property
@@ -162,6 +212,8 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
 
         Called by menu or toolbar action (UI 'slot')
         """
+        if self.running:
+            return
         if not self.boss.ensure_book(_('You must first open a book to tweak, before trying to Add QR Trackers.')):
             return
         if self.book_title is None:
@@ -193,39 +245,88 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
                 return
 
         self.boss.add_savepoint(_('Before: Filidel: Add QR trackers ({0})').format(datetime.now().strftime('%c')))
-        with BusyCursor():
+        progress = ProgressRunner(self.gui, _('Filidel: Add QR trackers'))
+        if self.cprefs['timing'] or calibre.constants.DEBUG:
+            self.timer = StageTimer()
+        profiler = None
+        if self.profile_next_run:
+            self.profile_next_run = False
+            self.plugin_ui_refresh()
+            profiler = progress.profiler = RunProfiler()
+            profiler.start()
+        self.running = True
+        try:
             try:
-                num_qr, num_max, grouped_exc = self.process_files()
-            except Exception:
-                import traceback
-                error_dialog(self.gui,
-                             _('Failed to add QR trackers'),
-                             _('The complete error details may be viewed by clicking the "Show details" button'),
-                             det_msg=traceback.format_exc(),
-                             show=True)
-                self.boss.rewind_savepoint()
-            else:
-                if grouped_exc is not None:
-                    show_report(False,
-                                _('The following items could not be processed'),
-                                grouped_exc.messages,
-                                self.gui, False)
-                msg = _('{0} QR images were added out of {1}. Click "See What Changed" below to view differences.').format(
-                    num_qr, num_max)
-                d = info_dialog(self.gui,
-                                _('Filidel plugin has added QR trackers'),
-                                msg,
-                                show=False)
-                d.b = d.bb.addButton(_('See what &changed'), d.bb.AcceptRole)
-                # d.b.setIcon(QIcon(I('diff.png'))), b.setAutoDefault(False)
-                d.b.clicked.connect(lambda: self.boss.show_current_diff(allow_revert=False), type=Qt.QueuedConnection)
-                d.exec_()
-                self.boss.apply_container_update_to_gui()
-                # todo: scroll to inserted element in single-mode
-                # self.gui.show_status_message(msg, 5)
-
-
-    def process_files(self):
+                with self.timer.stage('total'):
+                    num_qr, num_max, num_skipped, grouped_exc = self.process_files(progress)
+            finally:
+                progress.close()
+                self.running = False
+                timer, self.timer = self.timer, NULL_TIMER
+                if profiler is not None:
+                    profiler.stop()
+                    self.save_profile(profiler)
+        except Canceled:
+            self.boss.rewind_savepoint()
+            self.gui.show_status_message(_('Adding QR trackers was cancelled'), 5)
+        except Exception:
+            import traceback
+            error_dialog(self.gui,
+                         _('Failed to add QR trackers'),
+                         _('The complete error details may be viewed by clicking the "Show details" button'),
+                         det_msg=traceback.format_exc(),
+                         show=True)
+            self.boss.rewind_savepoint()
+        else:
+            if grouped_exc is not None:
+                show_report(False,
+                            _('The following items could not be processed'),
+                            grouped_exc.messages,
+                            self.gui, False)
+            msg = _('{0} QR images were added out of {1}. Click "See What Changed" below to view differences.').format(
+                num_qr, num_max)
+            if num_skipped > 0:
+                msg += ' ' + _('{0} chapters already had an up to date QR image.').format(num_skipped)
+            timing_report = timer.report()
+            if timer.enabled and calibre.constants.DEBUG:
+                self.write_timing_log(timing_report)
+            d = info_dialog(self.gui,
+                            _('Filidel plugin has added QR trackers'),
+                            msg,
+                            det_msg=timing_report,
+                            show=False)
+            d.b = d.bb.addButton(_('See what &changed'), d.bb.AcceptRole)
+            # d.b.setIcon(QIcon(I('diff.png'))), b.setAutoDefault(False)
+            d.b.clicked.connect(lambda: self.boss.show_current_diff(allow_revert=False), type=Qt.QueuedConnection)
+            d.exec_()
+            self.boss.apply_container_update_to_gui()
+            # todo: scroll to inserted element in single-mode
+            # self.gui.show_status_message(msg, 5)
+
+
+    def save_profile(self, profiler):
+        """Save the results of a ``RunProfiler`` next to the plugin preferences, and tell the user where"""
+        basename = '{0}-{1}'.format(self.name, datetime.now().strftime('%Y%m%d-%H%M%S'))
+        try:
+            paths = profiler.save(os.path.dirname(self.cprefs.file_path), basename)
+        except (IOError, OSError) as e:
+            self.gui.show_status_message(_('Could not save profile: {0}').format(e), 10)
+        else:
+            self.gui.show_status_message(_('Profile saved to {0}').format(', '.join(paths)), 10)
+
+
+    def write_timing_log(self, timing_report):
+        """Append a timing report to the log file next to the plugin preferences"""
+        path = os.path.join(os.path.dirname(self.cprefs.file_path), self.name + '-timing.log')
+        try:
+            with open(path, 'ab') as f:
+                f.write('=== {0} ({1})\n{2}\n\n'.format(
+                    datetime.now().strftime('%c'), self.book_title, timing_report).encode('utf-8'))
+        except (IOError, OSError):
+            pass
+
+
+    def process_files(self, progress=None):
         """
         Run plugin logic against one or more several "names"
 
@@ -235,62 +336,203 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
             - Generate QR text contents, convert to indexed png
             - Get node insertion point and contents
             - (over)write target image to spine
+        progress, if not None, is a ``ProgressRunner``: analysis and encoding then run in a background
+        thread, and changes are applied to the container in batches, reporting progress in between.
+        Raise ``Canceled`` if the user cancels from the progress dialog
         """
+        self.chapter_analyses = {}
+        self.changeset = ContainerChangeset()
+        try:
+            return self._process_files(progress)
+        finally:
+            self.chapter_analyses = None
+            self.changeset = None
+
+
+    def _process_files(self, progress=None):
+        """Implement process_files(), while chapter analyses are kept and image changes collected"""
+        container = self.current_container
         if self.act_on_current:
             names = [editor_name(self.gui.central.current_editor)]
         else:
-            cover_page_name = get_cover_page_name(self.current_container)
-            if cover_page_name is not None:
-                names = [name
-                         for name in self.current_container.manifest_items_of_type(OEB_DOCS)
-                         if cover_page_name != name]
-            else:
-                names = [name
-                         for name in self.current_container.manifest_items_of_type(OEB_DOCS)]
-                # is first item a simple cover wrapper?
-                if find_cover_image_in_page(self.current_container, names[0]) is not None:
-                    names = names[1:]
-
-        # todo: use a progress dialog class worker
-        # d = QrAddingProgress(names=names)
-        names_to_process = [name
-                            for name in self.get_probable_chapters(names, 0.3)]
-        if len(names_to_process) == 0:
-            raise GroupedAbortError([_('Filidel has found no suitable candidate HTML page to process in the book spine.')])
+            with self.timer.stage('book_names'):
+                names = self.book_names(container)
+        self.timer.count('documents', len(names))
+
+        if progress is not None:
+            analysis = progress.run_in_thread(partial(self.analyse_chapters, container, names),
+                                              _('Looking for chapters...'))
+        else:
+            analysis = self.analyse_chapters(container, names)
+        num_max, chapters, num_skipped, logarray = analysis
 
-        logarray = []
         num_qr = 0
-        for name in names_to_process:
+        timer = self.timer
+        for i, (name, title, text, data) in enumerate(chapters):
+            if progress is not None and i % self.apply_batch_size == 0:
+                progress.report(i, len(chapters), _('Adding QR images...'))
             try:
-                title = self.get_chapter_title(self.current_container, name)
                 # prepare_html_node() invokes remove_previous_qr(), so make sure to only insert target image afterwards
-                insert_parent = self.prepare_html_node(self.current_container, name)
-                self.current_container.dirty(name)
-
-                qr_image_name = self.generate_qrcode(self.current_container, name, title)  # add_to_spine=True
-                self.embed_qr_link(self.current_container, name, insert_parent, qr_image_name)
-                self.current_container.dirty(name)
+                with timer.stage('prepare_node', name):
+                    insert_parent = self.prepare_html_node(container, name)
+                container.dirty(name)
+
+                with timer.stage('add_image', name):
+                    qr_image_name = self.generate_qrcode(container, name, title, data=data)  # add_to_spine=True
+                with timer.stage('embed_link', name):
+                    self.embed_qr_link(container, name, insert_parent, qr_image_name)
+                insert_parent.attrib[self.qr_hash_attribute] = self.qr_hash(text)
+                container.dirty(name)
             except AbortError as e:  # those are raised errors where stack trace is not deemed very important
                 logarray.append('<b>{name}</b>: {msg}'.format(name=name, msg=e.message))
             else:
                 num_qr += 1
+        if progress is not None:
+            progress.report(len(chapters), len(chapters), _('Updating the book manifest...'))
+        with timer.stage('apply_changeset'):
+            self.apply_changeset(container, self.changeset)
         grouped_exc = GroupedAbortError(logarray) if len(logarray) > 0 else None
-        return num_qr, len(names_to_process), grouped_exc
+        return num_qr, num_max, num_skipped, grouped_exc
+
+
+    def book_names(self, container):
+        """Return the names of the (x)html files of a book, except its cover page"""
+        cover_page_name = get_cover_page_name(container)
+        if cover_page_name is not None:
+            return [name
+                    for name in container.manifest_items_of_type(OEB_DOCS)
+                    if cover_page_name != name]
+        names = [name
+                 for name in container.manifest_items_of_type(OEB_DOCS)]
+        # is first item a simple cover wrapper?
+        if find_cover_image_in_page(container, names[0]) is not None:
+            names = names[1:]
+        return names
 
-    def get_probable_chapters(self, names, min_score):
+
+    def analyse_chapters(self, container, names, report=None):
+        """
+        Select chapters to process, read their titles and encode their QR images
+
+        Only reads from the container, so that it can run in a background thread.
+        report(done, total, label=None), if given, is called for progress reporting
+        Return the number of candidate chapters, the list of (name, title, text, image data)
+        of chapters to change, the number of chapters skipped as up to date, and a list of errors
+        """
+        report = report or (lambda done, total, label=None: None)
+
+        if self.cprefs['feature_cache_size'] > 0:
+            path = os.path.join(os.path.dirname(self.cprefs.file_path), self.name + '-features.json')
+            self.feature_cache = FeatureCache(path, self.cprefs['feature_cache_size'])
+        timer = self.timer
+        try:
+            names_to_process = [name
+                                for name in self.get_probable_chapters(names, report=report)]
+        finally:
+            if self.feature_cache is not None:
+                timer.count('feature_cache_hits', self.feature_cache.hits)
+                timer.count('feature_cache_misses', self.feature_cache.misses)
+                self.feature_cache.save()
+                self.feature_cache = None
+        timer.count('candidates', len(names_to_process))
+        if len(names_to_process) == 0:
+            raise GroupedAbortError([_('Filidel has found no suitable candidate HTML page to process in the book spine.')])
+
+        logarray = []
+        chapters = []
+        for i, name in enumerate(names_to_process):
+            report(i, len(names_to_process), _('Reading chapter titles...'))
+            try:
+                with timer.stage('title', name):
+                    chapters.append((name, self.get_chapter_title(container, name)))
+            except AbortError as e:  # those are raised errors where stack trace is not deemed very important
+                logarray.append('<b>{name}</b>: {msg}'.format(name=name, msg=e.message))
+
+        num_skipped = 0
+        if self.cprefs['incremental']:
+            outdated = []
+            for name, title in chapters:
+                with timer.stage('up_to_date', name):
+                    if not self.is_qr_up_to_date(container, name, self.qr_text(title)):
+                        outdated.append((name, title))
+            num_skipped = len(chapters) - len(outdated)
+            chapters = outdated
+        timer.count('skipped', num_skipped)
+
+        # Encode every image up front, so that the QR encoder shares its work across the whole book
+        texts = [self.qr_text(title) for name, title in chapters]
+        with timer.stage('encode'):
+            images = self.encode_qr_images(texts, report=report)
+
+        return (len(names_to_process),
+                [(name, title, text, data) for (name, title), text, data in zip(chapters, texts, images)],
+                num_skipped,
+                logarray)
+
+    def get_probable_chapters(self, names, min_score=None, report=None):
         """
         Gather pages deemed to have content
 
         Return an iterator containing items scoring above or equal to min_score
-        (in [0.0-1.0] range)
+        (in [0.0-1.0] range), which defaults to the chapter model one
+        report(done, total, label=None), if given, is called for progress reporting
         """
-        for name in names:
-            if self.real_chapter_probability(self.current_container, name) >= min_score:
+        model = self.chapter_model()
+        if min_score is None:
+            min_score = model.min_score
+        timer = self.timer
+        for i, name in enumerate(names):
+            if report is not None:
+                report(i, len(names), _('Looking for chapters...'))
+            with timer.stage('score', name):
+                score = self.real_chapter_probability(self.current_container, name, model)
+            if score >= min_score:
                 # We do not want to attach QR codes to cover page, galleries and so forth
                 yield name
 
 
-    def real_chapter_probability(self, container, name):
+    def chapter_analysis(self, container, name, prefs=None):
+        """
+        Return the ``ChapterAnalysis`` of an (x)html file
+
+        While process_files() runs, analyses are kept, so that each document is only analysed once
+        """
+        prefs = prefs or self.cprefs
+
+        if self.chapter_analyses is not None and name in self.chapter_analyses:
+            return self.chapter_analyses[name]
+        with self.timer.stage('parse', name):
+            analysis = ChapterAnalysis(container.parsed(name), prefs['node_element_id'], self.title_headings_list)
+        if self.chapter_analyses is not None:
+            self.chapter_analyses[name] = analysis
+        return analysis
+
+
+    def chapter_model(self, prefs=None):
+        """Return the ``ChapterModel`` scoring chapters, with weights from preferences"""
+        prefs = prefs or self.cprefs
+
+        return ChapterModel(prefs['chapter_model'])
+
+
+    def chapter_features(self, container, name, model):
+        """
+        Return the ``ChapterFeatures`` of an (x)html file
+
+        Features are looked up in the feature cache while analyse_chapters() runs
+        """
+        text = container.raw_data(name)
+        if len(text) >= model.large_size or self.feature_cache is None:
+            return extract_features(text, partial(self.chapter_analysis, container, name), model.large_size)
+        key = self.feature_cache.key(text)
+        features = self.feature_cache.get(key)
+        if features is None:
+            features = extract_features(text, partial(self.chapter_analysis, container, name), model.large_size)
+            self.feature_cache.put(key, features)
+        return features
+
+
+    def real_chapter_probability(self, container, name, model=None):
         """
         Compute probability a given chapter has textual contents
 
@@ -298,31 +540,8 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
         Return a decimal value in [0-1] representing the computed probability
         name refers to a chapter with actual content.
         """
-        score = 0.8
-        if len(container.raw_data(name)) >= 10240:
-            return score  # quite positive it is a chapter
-        root = container.parsed(name)  # Parsed HTML files are lxml elements
-        if 'epub' in root.nsmap:
-            score += 0.3
-            nsmap = {}
-            nsmap['epub'] = root.nsmap['epub']
-            for element in root.xpath('//*[@epub:type]', namespaces=nsmap):
-                # print("*-{0}\n".format(element.attrib))
-                # retard notation brought to you by lxml
-                epubtype = element.attrib['{' + '{0}'.format(nsmap['epub']) + '}type']
-                # print(" - type = {0}\n".format(epubtype))
-                if epubtype is not None and epubtype.lower() == 'introduction':
-                    score += -0.7
-        # Score down pages which look like an illustration gallery
-        images_tag_count = root.xpath('count(//*[local-name()="svg" or local-name()="img"])')
-        # print("svg/img = {0}\n".format(images_tag_count))
-        if images_tag_count < 1:
-            score += 0.3
-        else:
-            score += -images_tag_count / len(container.raw_data(name)) * 1024
-
-        # print("Name = {0} Score= {1} -> {2}\n".format(name, score, max(0.0, min(1.0, score))))
-        return max(0.0, min(1.0, score))
+        model = model or self.chapter_model()
+        return model.score(self.chapter_features(container, name, model))
 
 
     def get_chapter_title(self, container, name):
@@ -332,47 +551,10 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
         Falls back to entry filename as a last resort
         Returns a string
         """
-        root = container.parsed(name)
-        nsmap = deepcopy(root.nsmap)
-        nsmap.pop(None, None)
-
-        if 'epub' in root.nsmap:
-            for heading in self.title_headings_list:
-                expr = '//*[@epub:type="title" and local-name()="' + heading + '"]'
-                title = self._get_enclosed_text_from_xpath(root, expr, nsmap)
-                if title is not None:
-                    return title
-            expr = '//*[@epub:type="chapter" and @title!=""]'
-            for node in root.xpath(expr, namespaces=nsmap):
-                title = node.attrib['title']
-                if title is not None and title.strip() != "":
-                    return title.strip()
-
-        for titlenode in root.xpath('//title', namespaces=nsmap):
-            if len(titlenode.text.strip()) > 0:
-                # print("<title> = {0}\n".format(titlenode.text.strip()))
-                return titlenode.text.strip()
-
-        for heading in self.title_headings_list:
-            expr = '//*[local-name()="' + heading + '"]'
-            title = self._get_enclosed_text_from_xpath(root, expr, nsmap)
-            if title is not None:
-                return title
-        return os.path.basename(name)
-
-
-    def _get_enclosed_text_from_xpath(self, element, expr, namespaces):
-        """
-        Select an element via provided xpath expression and returns its rendered contents
-
-        Convert inner text/nodes to text using ``lxml``, regardless of spans etc.
-        """
-        headingnodes = element.xpath(expr, namespaces=namespaces)
-        if len(headingnodes) > 0:
-            title = etree.tostring(headingnodes[0], method='text', encoding="UTF-8").strip()
-            # print("heading type = {0}\n".format(title))
+        title = self.chapter_analysis(container, name).title
+        if title is not None:
             return title
-        return None
+        return os.path.basename(name)
 
 
     def prepare_html_node(self, container, name, prefs=None):
@@ -386,40 +568,54 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
         # prefs = {k:prefs.get(k) for k in cprefs.defaults}
         # prefs = Prefs(**prefs)
 
-        root = container.parsed(name)
-
-        expr = '//*[' + ' or '.join(map(lambda x: '@id="{0}"'.format(x), prefs['node_element_id'])) + ']'
-        nodes = root.xpath(expr)
-        insert_element = nodes[0] if len(nodes) > 0 else None
+        insert_element = self.find_tracker_element(container, name, prefs)
         # raise AbortError(etree.tostring(nodes[0], method='html', encoding="UTF-8").strip())
         self.remove_previous_qr(container, name, insert_element)
         insert_element = self.create_element_placeholder(container, name, insert_element)
         return insert_element
 
 
+    def find_tracker_element(self, container, name, prefs=None):
+        """Return the existing element holding the QR image, or None"""
+        return self.chapter_analysis(container, name, prefs).tracker
+
+
     def remove_previous_qr(self, container, name, insert_element):
         """
         Remove previous image from spine, if applicable.
 
         insert_element must be an instance of lxml's API element
         """
-        container.remove_item(self.target_qr_filename_from_name(name))
-        if insert_element is None:
-            return
+        with self.timer.stage('remove_previous_qr', name):
+            self._remove_previous_qr(container, name, insert_element)
 
-        root = container.parsed(name)
 
-        for elt in insert_element.iter('{' + '{0}'.format(root.nsmap[None]) + '}img'):
-            # resolve relative or absolute hyperlink
-            qrname = container.href_to_name(elt.attrib['src'], name)
-            # print(etree.tostring(elt, method='html', encoding="UTF-8").strip())
-            if qrname not in container.names_that_must_not_be_removed:
-                # print("! {0}\n".format(qrname))
-                self.boss.commit_dirty_opf()
-                container.remove_item(qrname)
-                if qrname in editors:
-                    self.boss.close_editor(qrname)
-            break
+    def _remove_previous_qr(self, container, name, insert_element):
+        """Implement remove_previous_qr()"""
+        changeset = self.changeset if self.changeset is not None else ContainerChangeset()
+        changeset.remove(self.target_qr_filename_from_name(name))
+        if insert_element is not None:
+            root = self.chapter_analysis(container, name).root
+            for elt in insert_element.iter('{' + '{0}'.format(root.nsmap[None]) + '}img'):
+                # resolve relative or absolute hyperlink
+                changeset.remove(container.href_to_name(elt.attrib['src'], name))
+                break
+        if self.changeset is None:
+            self.apply_changeset(container, changeset)
+
+
+    def apply_changeset(self, container, changeset):
+        """
+        Apply a ``ContainerChangeset`` to container
+
+        The OPF editor, if any, is committed once beforehand, and editors of removed files are closed
+        """
+        if len(changeset) == 0:
+            return
+        self.boss.commit_dirty_opf()
+        for name in changeset.apply(container):
+            if name in editors:
+                self.boss.close_editor(name)
 
 
     def create_element_placeholder(self, container, name, insert_element, prefs=None):
@@ -429,7 +625,7 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
         insert_element must be an instance of lxml's API element
         """
         prefs = prefs or self.cprefs
-        root = container.parsed(name)
+        analysis = self.chapter_analysis(container, name, prefs)
 
         if insert_element is not None:
             if 'id' not in insert_element.attrib:
@@ -437,50 +633,144 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
             if 'class' not in insert_element.attrib:
                 insert_element.attrib['class'] = prefs['node_element_id'][0]
             container.dirty(name)
-            etree.tostring(root)
             return insert_element
 
-        body_nodes = root.xpath('//*[local-name()="body"][1]')
-        if len(body_nodes) == 0:
+        if analysis.body is None:
             raise AbortError("{0} does not have a &lt;body> tag, please check book prior to running this plugin.".format(name))
-        node = etree.SubElement(body_nodes[0], XHTML(prefs['node_element_tagname']),
+        node = etree.SubElement(analysis.body, XHTML(prefs['node_element_tagname']),
                                 id=prefs['node_element_id'][0])
         node.attrib['class'] = prefs['node_element_id'][0]
         node.tail = '\n'
-        if prefs['node_element_type'] is not None and 'epub' in root.nsmap:
-            node.attrib['{' + '{0}'.format(root.nsmap['epub']) + '}type'] = prefs['node_element_type']
-        # works: etree.SubElement(body_nodes[0], XHTML('div'), id='testing0')
+        if prefs['node_element_type'] is not None and analysis.epub_ns is not None:
+            node.attrib['{' + '{0}'.format(analysis.epub_ns) + '}type'] = prefs['node_element_type']
+        # works: etree.SubElement(analysis.body, XHTML('div'), id='testing0')
         # works: etree.SubElement(root, XHTML('span'), id='testing')
+        analysis.tracker = node
         container.dirty(name)
         return node
 
 
-    def generate_qrcode(self, container, name, item_title, add_to_spine=True, prefs=None):
+    def qr_text(self, item_title):
+        """Return the message encoded in the QR image of a chapter"""
+        return _('Completed {0} - {1}').format(self.book_title, item_title)
+
+
+    def qr_hash(self, text, prefs=None):
+        """Return a hash of a QR image contents, from its message and rendering options"""
+        prefs = prefs or self.cprefs
+
+        qr = self.qr_encoder(prefs).qr
+        return QrImageCache.key(text, qr.error_correction, qr.box_size, qr.border, prefs['image_format'])
+
+
+    def is_qr_up_to_date(self, container, name, text, prefs=None):
+        """
+        Tell whether a chapter already links to the QR image of a message
+
+        That is, its tracker element holds the hash of that image, and links to
+        the expected image name, which exists in the book
+        """
+        prefs = prefs or self.cprefs
+
+        insert_element = self.find_tracker_element(container, name, prefs)
+        if insert_element is None or insert_element.get(self.qr_hash_attribute) != self.qr_hash(text, prefs):
+            return False
+        root = self.chapter_analysis(container, name, prefs).root
+        for elt in insert_element.iter('{' + '{0}'.format(root.nsmap[None]) + '}img'):
+            qrname = container.href_to_name(elt.get('src', ''), name)
+            return qrname == self.target_qr_filename_from_name(name, prefs) and container.has_name(qrname)
+        return False
+
+
+    def qr_encoder(self, prefs=None):
+        """Return a ``QRBatchEncoder`` producing images in the preferred format"""
+        prefs = prefs or self.cprefs
+
+        if prefs['image_format'] == 'svg':
+            return QRBatchEncoder(image_factory=SvgPathImage)
+        return QRBatchEncoder(image_factory=PurePngImage)
+
+
+    @property
+    def image_cache(self):
+        """Return the on-disk cache of encoded images, stored next to the plugin preferences"""
+        return QrImageCache(os.path.join(os.path.dirname(self.cprefs.file_path), self.name + '-cache'),
+                            self.cprefs['image_cache_size'])
+
+
+    def encode_qr_images(self, texts, prefs=None, report=None):
+        """
+        Encode QR images for a list of messages
+
+        Look up previously encoded images in the image cache, and encode the others
+        in batches
+        report(done, total, label=None), if given, is called for progress reporting
+        Return the list of image file contents
+        """
+        prefs = prefs or self.cprefs
+
+        encoder = self.qr_encoder(prefs)
+        cache = self.image_cache if prefs['image_cache_size'] > 0 else None
+        keys = []
+        images = {}
+        if cache is not None:
+            keys = [self.qr_hash(text, prefs) for text in texts]
+            for text, key in zip(texts, keys):
+                if text not in images:
+                    data = cache.get(key)
+                    if data is not None:
+                        images[text] = data
+
+        missing = [text for text in texts if text not in images]
+        encoded = []
+        for i in range(0, len(missing), self.apply_batch_size):
+            if report is not None:
+                report(i, len(missing), _('Generating QR images...'))
+            encoded.extend(encoder.encode_images(missing[i:i + self.apply_batch_size]))
+        images.update(zip(missing, encoded))
+        self.timer.count('encoded', len(missing))
+
+        if cache is not None:
+            missing = set(missing)
+            for text, key in zip(texts, keys):
+                if text in missing:
+                    missing.discard(text)
+                    cache.put(key, images[text])
+            self.timer.count('image_cache_hits', cache.hits)
+            self.timer.count('image_cache_misses', cache.misses)
+            cache.evict()
+        return [images[text] for text in texts]
+
+
+    def generate_qrcode(self, container, name, item_title, add_to_spine=True, prefs=None, data=None):
         """
         Generate a QR image and optionally add it to spine
 
+        data may hold the image file contents, if they were already encoded
+        While process_files() runs, the image is only added to the run changeset
         Return its name
         """
         prefs = prefs or self.cprefs
 
-        qr = QRCode()
-        qr.add_data(_('Completed {0} - {1}').format(self.book_title, item_title))
-        im = qr.make_image()
-        data = None
-        with io.BytesIO() as output:
-            im.save(output, format='png')
-            output.seek(0)
-            data = output.read()
-        # debug: set edit_file param to True to automatically open in editor
-        return container.add_file(self.target_qr_filename_from_name(name), data)
+        if data is None:
+            data = self.qr_encoder(prefs).encode_image(self.qr_text(item_title))
+        media_type = 'image/svg+xml' if prefs['image_format'] == 'svg' else 'image/png'
+        changeset = self.changeset if self.changeset is not None else ContainerChangeset()
+        image_name = changeset.add(self.target_qr_filename_from_name(name), data, media_type)
+        if self.changeset is None:
+            self.apply_changeset(container, changeset)
+        return image_name
 
     def target_qr_filename_from_name(self, item_name, prefs=None):
-        """Return spine name for target QR png"""
+        """Return spine name for target QR image"""
         prefs = prefs or self.cprefs
 
         path = os.path.basename(item_name)
         path_noext = os.path.splitext(path)[0]
-        return prefs['imagepath_fmt'].format(pagename=path, pagename_noext=path_noext)
+        target = prefs['imagepath_fmt'].format(pagename=path, pagename_noext=path_noext)
+        if prefs['image_format'] == 'svg':
+            target = os.path.splitext(target)[0] + '.svg'
+        return target
 
 
     def embed_qr_link(self, container, name, insert_element, image_name, prefs=None):
@@ -489,7 +779,7 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
 
         Commit changes to editor
         """
-        root = container.parsed(name)
+        root = self.chapter_analysis(container, name, prefs).root
 
         eltimg = None
         for elt in insert_element.iter('{' + '{0}'.format(root.nsmap[None]) + '}img'):
@@ -502,5 +792,4 @@ class EditBook_QrCodeTrackerFilidelPlugin(Tool):
         eltimg.attrib['src'] = container.name_to_href(image_name, name)
 
         container.dirty(name)
-        print(etree.tostring(insert_element, method='html', encoding="UTF-8").strip())
         return eltimg
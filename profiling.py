@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+class RunProfiler(object):
+    """
+    Profile a run with ``cProfile``, and trace its memory allocations with ``tracemalloc`` if available
+
+    Before Python 3.12, cProfile only sees the thread it is enabled in, so work done in other
+    threads must go through ``runcall()``; their profiles are merged when saving.
+    From Python 3.12, cProfile sees every thread, and only one profiler may be active at a time.
+    """
+
+    def __init__(self, top=30):
+        """Set the number of allocation sites listed in the summary"""
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.peak = None
+        self.tracing = False
+
+    def start(self):
+        """Start profiling the calling thread, and tracing allocations"""
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+        self.profile.enable()
+
+    def stop(self):
+        """Stop profiling, and take a snapshot of traced allocations"""
+        self.profile.disable()
+        if self.tracing:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.tracing = False
+
+    def runcall(self, func, *args, **kwargs):
+        """Call func in the current (background) thread, profiling it"""
+        if sys.version_info >= (3, 12):  # already seen by self.profile
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            with self.lock:
+                self.thread_profiles.append(profile)
+
+    def save(self, directory, basename):
+        """
+        Write the merged profile as basename.prof and the allocation summary as basename-memory.txt
+
+        Return the paths of the files written
+        """
+        paths = [os.path.join(directory, basename + '.prof')]
+        stats = pstats.Stats(self.profile)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(paths[0])
+        if self.snapshot is not None:
+            paths.append(os.path.join(directory, basename + '-memory.txt'))
+            with open(paths[1], 'wb') as f:
+                f.write(self.memory_summary().encode('utf-8'))
+        return paths
+
+    def memory_summary(self):
+        """Return the top allocation sites still holding memory at the end of the run, as plain text"""
+        lines = ['Peak traced memory: {0} KiB'.format(self.peak // 1024),
+                 'Top {0} allocation sites of memory still held at the end of the run:'.format(self.top)]
+        for stat in self.snapshot.statistics('lineno')[:self.top]:
+            lines.append(str(stat))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+"""
+Check that quick_scan agrees with ChapterAnalysis, or tells it can not
+
+Run from the repository root: python -m unittest tests.test_analysis
+"""
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import random
+import unittest
+
+from lxml import etree
+
+from analysis import ChapterAnalysis, quick_scan
+from benchmarks.synthetic import chapter, gallery, introduction
+
+HEADINGS = ('h1', 'h2', 'h3', 'h4')
+TRACKER_IDS = ('qrtracker', 'qrtrack', 'filidel')
+
+XHTML = 'xmlns="http://www.w3.org/1999/xhtml"'
+EPUB = XHTML + ' xmlns:epub="http://www.idpf.org/2007/ops"'
+SVG = 'xmlns:svg="http://www.w3.org/2000/svg"'
+
+
+def document(namespaces, body):
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<html {0}><head><title>T</title></head>'
+            '<body>{1}</body></html>').format(namespaces, body)
+
+
+def analysis_counts(text):
+    """Return the chapter score inputs as ChapterAnalysis finds them"""
+    analysis = ChapterAnalysis(etree.fromstring(text.encode('utf-8')), TRACKER_IDS, HEADINGS)
+    return analysis.epub_ns is not None, analysis.introductions_count, analysis.images_count
+
+
+class QuickScanTest(unittest.TestCase):
+
+    def assertAgrees(self, text):
+        self.assertEqual(quick_scan(text), analysis_counts(text), text)
+
+    def assertUndecided(self, text):
+        self.assertIsNone(quick_scan(text), text)
+
+    def test_images(self):
+        self.assertAgrees(document(XHTML, '<p>no image</p>'))
+        self.assertAgrees(document(XHTML, '<div><img src="a.jpg"/><img\nsrc="b.jpg" /></div>'))
+        self.assertAgrees(document(EPUB, '<svg xmlns="http://www.w3.org/2000/svg"><image/></svg><imgx/>'))
+
+    def test_prefixed_svg(self):
+        text = document(EPUB, '<svg:svg {0}><svg:image/></svg:svg><img src="a.jpg"/>'.format(SVG))
+        self.assertEqual(quick_scan(text), (True, 0, 2))
+        self.assertAgrees(text)
+
+    def test_upper_case_tags(self):
+        self.assertUndecided(document(XHTML, '<IMG src="a.jpg"/>'))
+        self.assertUndecided(document(XHTML, '<svg:SVG {0}/>'.format(SVG)))
+
+    def test_comments(self):
+        self.assertUndecided(document(XHTML, '<!-- <img src="a.jpg"/> -->'))
+        self.assertUndecided(document(XHTML, '<!-- nothing --><img src="a.jpg"/>'))
+
+    def test_cdata(self):
+        self.assertUndecided(document(XHTML, '<p><![CDATA[<img src="a.jpg"/>]]></p>'))
+
+    def test_introduction(self):
+        # in epub documents, only a parse tells an epub:type value from text
+        self.assertUndecided(document(EPUB, '<section epub:type="introduction"><p>Text</p></section>'))
+        self.assertUndecided(document(EPUB, '<p>An introduction to the matter</p>'))
+        self.assertUndecided(document(EPUB, '<section epub:type="Introduction"/>'))
+        # elsewhere there is no epub:type, so introductions are never counted
+        text = document(XHTML, '<h1>Introduction</h1><p>An introduction</p><img src="a.jpg"/>')
+        self.assertEqual(quick_scan(text), (False, 0, 1))
+        self.assertAgrees(text)
+
+    def test_no_root(self):
+        self.assertUndecided('<body><img src="a.jpg"/></body>')
+
+    def test_synthetic_books(self):
+        rng = random.Random(3)
+        for number in range(1, 60):
+            for epub3 in (True, False):
+                for make in (chapter, gallery, introduction):
+                    text = make(rng, number, epub3)
+                    counts = quick_scan(text)
+                    if counts is not None:
+                        self.assertEqual(counts, analysis_counts(text), (make.__name__, number, epub3))
+                    elif make is not introduction or not epub3:
+                        self.fail('undecided {0} {1}, epub3={2}'.format(make.__name__, number, epub3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+"""
+Check that data added with OPTIMIZE_MINIMAL is split for the size class of the version found
+
+Run from the repository root: python -m unittest tests.test_best_fit
+"""
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import random
+import unittest
+
+from extern import constants, util
+from extern.main import QRCode
+
+CHARACTERS = b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:abcdefgh'
+
+
+def bit_length(chunks, version):
+    return sum(chunk.bit_length(version) for chunk in chunks)
+
+
+class MinimalBestFitTest(unittest.TestCase):
+
+    def test_minimal_for_version_found(self):
+        rng = random.Random(1)
+        for i in range(150):
+            alphabet = CHARACTERS[:rng.choice((10, 45, len(CHARACTERS)))]
+            data = bytes(bytearray(rng.choice(bytearray(alphabet)) for j in range(rng.choice((50, 400, 1500)))))
+            qr = QRCode(error_correction=constants.ERROR_CORRECT_L)
+            qr.add_data(data, optimize=util.OPTIMIZE_MINIMAL)
+            version = qr.best_fit()
+            self.assertEqual(b''.join(chunk.data for chunk in qr.data_list), data)
+            self.assertEqual(bit_length(qr.data_list, version),
+                             bit_length(util.minimal_data_chunks(data, version), version), (i, version))
+            if version > 1:
+                smaller = bit_length(util.minimal_data_chunks(data, version - 1), version - 1)
+                self.assertGreater(smaller, util.BIT_LIMIT_TABLE[qr.error_correction][version - 1], (i, version))
+
+    def test_other_data_kept_in_place(self):
+        qr = QRCode()
+        qr.add_data(b'HEAD', optimize=0)
+        qr.add_data(b'1234567890' * 40 + b'abc' * 100, optimize=util.OPTIMIZE_MINIMAL)
+        qr.add_data(b'tail', optimize=0)
+        qr.make()
+        self.assertGreaterEqual(qr.version, 10)
+        self.assertEqual(qr.data_list[0].data, b'HEAD')
+        self.assertEqual(qr.data_list[-1].data, b'tail')
+        self.assertEqual(b''.join(chunk.data for chunk in qr.data_list[1:-1]), b'1234567890' * 40 + b'abc' * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
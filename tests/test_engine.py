@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+"""
+Check that the optimized QR encoder produces the same codes as qrcode 5.3
+
+Run from the repository root: python -m unittest tests.test_engine
+"""
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import hashlib
+import random
+import unittest
+
+from extern import base, constants, util
+from extern.main import QRCode
+
+EC_LEVELS = (constants.ERROR_CORRECT_L, constants.ERROR_CORRECT_M,
+             constants.ERROR_CORRECT_Q, constants.ERROR_CORRECT_H)
+
+PAYLOADS = ('1', '0123456789' * 3, 'HELLO WORLD', 'Completed My Book - Chapter 1: The Beginning',
+            'Compl\xe9t\xe9 日本語 - ' * 3, 'A' * 200, '9' * 500, 'x' * 1000, 'ab12345678CD' * 20)
+
+# Digests of the matrices drawn by qrcode 5.3, see matrix_digest()
+# (payload index, error correction) -> (version, digest) of the best fit code, with a border of 2
+FITTED = {
+    (0, 1): (1, '2740bcd94dbb'),
+    (0, 0): (1, '04e3f94ad8ad'),
+    (0, 3): (1, '6dafe6d65723'),
+    (0, 2): (1, 'b4112d702267'),
+    (1, 1): (1, '3ebf94d1524a'),
+    (1, 0): (1, 'a4a350c2314c'),
+    (1, 3): (2, '7546d12a27d0'),
+    (1, 2): (2, 'be64c80ceb59'),
+    (2, 1): (1, 'add3e631bc58'),
+    (2, 0): (1, '8241b2cf1179'),
+    (2, 3): (1, 'db1025e07768'),
+    (2, 2): (2, 'd1fef4edb57e'),
+    (3, 1): (3, '9ff351a7d1ad'),
+    (3, 0): (4, 'b108a7dfad35'),
+    (3, 3): (5, '6ec84ad4c140'),
+    (3, 2): (6, 'eac10839bfb9'),
+    (4, 1): (4, '1d0bc306c2f0'),
+    (4, 0): (5, '75cc9e271d7b'),
+    (4, 3): (6, 'c42f23b5eaa9'),
+    (4, 2): (8, 'b37a0fedc074'),
+    (5, 1): (7, '88bbe43edb88'),
+    (5, 0): (8, '6571c7ae5922'),
+    (5, 3): (10, '57390980810f'),
+    (5, 2): (11, '75481f2a1939'),
+    (6, 1): (9, 'b37277b0e8cc'),
+    (6, 0): (10, '6a5cb62361bd'),
+    (6, 3): (13, 'b47208fb9b29'),
+    (6, 2): (15, '4ed5e8019ed2'),
+    (7, 1): (22, '0ed43140cdc2'),
+    (7, 0): (26, '20774137c715'),
+    (7, 3): (31, 'c2f1087ae0e2'),
+    (7, 2): (36, '3ff8d7f3dccc'),
+    (8, 1): (9, 'eed112c75e92'),
+    (8, 0): (11, '1c1a7a7ed62c'),
+    (8, 3): (13, 'd7da1e437146'),
+    (8, 2): (16, 'b16cd2363391'),
+}
+
+# version -> digests of the code for 'chapter <version>' drawn with each mask pattern, with no border
+MASKED = {
+    1: ('61d755a0e550', '102368b50474', 'a10fd5c2750c', 'd5de8063b66f',
+        'f17afd96fa00', '5e2d324cb3a0', '7433470acbb3', '7c08b74ed488'),
+    2: ('cafbf74c87c9', '2be4e3fa3d25', '4f5727b2ecd0', '1ef5beb41509',
+        'b37996604463', 'a367925c30c5', '4b3c3bba9211', '71e9ba0c9e90'),
+    3: ('86fcd0027d1e', '700693641e0a', '34417389df00', 'dc70e8396a0c',
+        '184050e468c4', 'e611ebf8c2df', 'b72e8ad17a10', '54e5c2c4ae9b'),
+    4: ('eea4691f0aad', 'f9fced96fcf5', 'fe770e32a3e4', '818fff9c6c7a',
+        '795de7423611', '7d60ee053910', 'b8d4491af5ef', '00862933cefd'),
+    5: ('e073df7a6ed7', 'ebc4d73ed758', '77fbec321f22', 'dc4bbcc433aa',
+        '39d1832c13d1', '0f5f978fa5c1', 'f18c570078ca', '618ce4a4b4a7'),
+    6: ('bde5715dcdbf', '8858aab1290c', '52e8ebfd6281', 'ecd6297a69c3',
+        'a298f450c4b2', '6322c0773a25', 'd3f8ef52936b', '930ce6cfb429'),
+    7: ('efe8928ed532', '444d46e905ca', '025108689861', '43f292ca6cf7',
+        'c9ca6f0cde50', '9ec138a59fcf', 'ffbc7dad882f', 'f5fe966eeeb0'),
+    8: ('ae315eb0e2d7', '01ffe3698322', '304e74f79205', '84a4415c6760',
+        'e253c898931e', '991ae573a19c', 'ab881f2b193a', 'd62a40419178'),
+    9: ('00c3bf6e162b', '68dd1709fb91', '87723f2920ab', 'df39eb96c3d3',
+        '462bc7e06690', '92f479e3f567', '1ef8f2399b5b', '8758c2b34c56'),
+    10: ('c2187defc4ed', 'edd29da78327', '6def1c51cd0b', 'ed85f9df980b',
+         'dbad15922351', '29194a237170', '58ef19cb0f0d', '22bf18034e93'),
+    11: ('11967083765d', '8653921bef14', '6fff5f5e661c', '6b3c4f08679d',
+         '42c56626ac8e', 'e7de1e20ad09', '4ec9eb04df58', 'c9ff59cacff8'),
+    12: ('4c6b2ecbe514', 'ac42def19906', '960820dadf13', 'ff6f5f8c7967',
+         'f2306166bfbe', '1e247ef21604', '6403b472426c', '1c4ad8affcea'),
+    13: ('f9c19fa07404', 'e40484bb97b8', 'd1ee5f9eb671', 'b5323179ab58',
+         '3735284e967e', 'e922fa23faaf', '14cc03cac1f8', '77c9b2b6b41d'),
+    14: ('082e579a2983', 'd155e91504fb', '6108294c08ed', '8682a5944489',
+         'e67bca936551', '1a6996e09839', '23c8e1bff737', '5852c328b421'),
+    15: ('288adecf1377', 'c7387e056f1c', '0e7a932b8343', '899687331850',
+         '77eac67973bf', '8a170b31b2c6', '12f0ee4a63b5', '3d32a71b82ad'),
+    16: ('fb47bd0a7369', 'e0f24de316ad', '4d8291f9f681', '4bac49cfd167',
+         'a85377d91d15', '1ece8685a5e6', '9a0f9d875165', '94bace899e86'),
+    17: ('6047282f934f', '63a0efaff3fb', 'd9f548191411', '29853c6762b7',
+         'c4630c36ce4b', '21f3556902db', 'dcb33424812b', '72b2ed5fe1e6'),
+    18: ('0bf8ee7ab2cf', '92b49a4e5049', 'b560b96beab4', 'fd299662399c',
+         'a580b0ecb73f', '0438d2682da1', '210c8294f872', '254863d080b3'),
+    19: ('fa02522794b0', 'fefa5039d9d9', 'c49da7e74fba', '3934c9f9d9f7',
+         '0e5928c21547', 'ae16f4ca4ece', '74934116db1b', 'e2046d9c78b8'),
+    20: ('35a69c035d12', 'bc1edc081aa6', '4cfaf9ea5ac0', '539ded7bfb56',
+         '947dee9833f1', '0eb16f64e6c5', 'f2a10e367645', '1b9f88b5fecc'),
+    21: ('9d0610f43726', '1c443d8476b1', 'd8b7ddee0e8c', 'a0275ee00189',
+         '24f34cbd19bb', 'df34d3d89d29', 'edad8eb2f419', '2591c26126c5'),
+    22: ('a0bcce604afd', '18135816c085', '21679abf48e1', 'ba1a35355290',
+         '5bfc7ae3a77f', 'b3e0b15ad31a', 'f4a779d4b0ed', '8473c7aebbd2'),
+    23: ('b3a8a12aad46', '8426e75bac35', '226285541ee6', '7af589a25193',
+         '318a1d2b9b28', '3064533b28bc', '3b0ab1dea70a', 'be98b53f459a'),
+    24: ('cc7140460690', '96ea59cc8262', '03a5c05c517e', '0b0f3f3c061c',
+         '70301213e0fb', 'b5540ed7a29a', '8ffd4282d82e', '2e10e0cdc39f'),
+    25: ('a0f80f4f0024', '9dd21f55f04a', '56c61006d146', '870893cd2982',
+         '25bb59ff3e16', '5b0e0ff4a7dd', 'ebb80c136814', 'd4364f926064'),
+    26: ('c11fe96dd1e5', '48ab22117a4e', '3812c117c670', '79bc25159528',
+         '75726ea9a003', '34405e01dd6e', 'ec46ce78e054', '85824fe76acd'),
+    27: ('dfc53261b212', '6062c1b218ed', '5cfa530d239f', '49057127691c',
+         '674e84fbac59', 'fc8ff8426113', 'c2952197d49c', '4737cb6a396f'),
+    28: ('9d27d4cb7446', '11cf8a9c38dc', 'fdf75694843e', '4020e7545556',
+         'e9d1a9b2586c', 'aaf124978599', '12bc1bce1162', '58eb946719b1'),
+    29: ('ca7efd6ade7f', 'fba6193a55b3', '65b709d663be', 'f8c05b4beec6',
+         'efce0f8ec94f', '7282a4f9925e', 'df73dacb87c9', '9bda132cd23b'),
+    30: ('95a8b85c3b25', '8e7a4fbe81bd', '836ab27459dd', 'bedf7bd991dd',
+         '9395db0e66cf', 'a270059454fd', '6e041c08e928', 'b54d2875438f'),
+    31: ('9b4405332184', '14d86c9e8e7a', '88030ae368f5', 'ebaac5fe58c1',
+         '42cfefcbf8ef', '4145d894b5db', 'd2a3a8f73246', 'bb99974595b3'),
+    32: ('2fa9538402d2', 'baca56e2207a', 'bc84d3a98730', '17aec98528c0',
+         'abd2504e9ad5', '6e1dd89b3f65', '4a94f1e6bbc0', '87a2d484f689'),
+    33: ('981a3a5d3348', '45d0d0117dad', '942585ac3cbb', '0989f41e0767',
+         'a55b11015811', 'bc00e8d333ea', 'a8e2a50d5d42', '6182cf2439a7'),
+    34: ('6a3ee7b5f0e2', '3be7494960ee', '0ecc6c291d50', '8de03a4467bf',
+         '7f19340372b0', '1deaf7428537', 'd42192dec3b3', '3dbf5db8b3b8'),
+    35: ('aca3697bf022', '98fbb08aa756', '32e9fa256c73', '4beed4c8b7a9',
+         '443eb047f914', '0766f0e0f7cd', '30ba09980977', '7a87cd9e4b1e'),
+    36: ('69c7788f5379', 'f6abfa888af8', '148caf3b804f', 'b0a081e9a4ae',
+         'ea8b14111885', '424d8620e448', '8f292ee34f60', '170a6bb55f3f'),
+    37: ('4e65615b4633', '670b34931989', 'b7d8ba5c74c8', 'ffc2b5fd6d01',
+         'c2d97c306480', 'dcdcfe3158a4', '60dc7dd0560c', '6c09823cfe6e'),
+    38: ('deae2c9d072d', '0f7f0779c981', '9514e51a30c7', 'be997b6e10c3',
+         '61a0e95ab0a1', 'd330ff12e601', '0bdc98335eb5', 'f1cd35d60716'),
+    39: ('977460f54a96', 'a2715f5f886a', 'f6a77a8a75f6', '2bd79d3f4ef7',
+         '292f104e28ac', '87914ddfb466', '2d4b88eb9680', 'c04369015323'),
+    40: ('037e52398975', '9b12ba0be76d', '057dd9087fc4', '4cd91efd8edf',
+         '9e6af6ccbc7d', 'c3165d8aa31d', '29639ff67991', '626659474f4f'),
+}
+
+
+def matrix_digest(matrix):
+    """Return the start of the SHA-1 digest of the modules of matrix, as a string of 0 and 1"""
+    bits = ''.join('1' if cell else '0' for row in matrix for cell in row)
+    return hashlib.sha1(bits.encode('ascii')).hexdigest()[:12]
+
+
+def reference_rs_encode(data, ec_count):
+    """The error correction codewords of a data block, computed with polynomials as qrcode 5.3 did"""
+    generator = base.Polynomial([1], 0)
+    for i in range(ec_count):
+        generator = generator * base.Polynomial([1, base.gexp(i)], 0)
+    remainder = base.Polynomial(data, len(generator) - 1) % generator
+    offset = len(remainder) - ec_count
+    return [remainder[i + offset] if i + offset >= 0 else 0 for i in range(ec_count)]
+
+
+class RSEncodeTest(unittest.TestCase):
+
+    def test_matches_polynomial_division(self):
+        rng = random.Random(5)
+        blocks = set()
+        for entry in base.RS_BLOCK_TABLE:
+            for i in range(0, len(entry), 3):
+                blocks.add((entry[i + 1] - entry[i + 2], entry[i + 2]))
+        for ec_count, data_count in sorted(blocks):
+            for data in ([0] * data_count, [255] * data_count,
+                         [rng.randrange(256) for i in range(data_count)],
+                         [0] * (data_count // 2) + [rng.randrange(256) for i in range(data_count - data_count // 2)]):
+                self.assertEqual(base.rs_encode(data, ec_count), reference_rs_encode(data, ec_count),
+                                 (ec_count, data_count))
+
+
+class BitBufferTest(unittest.TestCase):
+
+    def test_matches_bit_string(self):
+        rng = random.Random(6)
+        for i in range(200):
+            buffer = util.BitBuffer()
+            bits = ''
+            for j in range(rng.randint(0, 40)):
+                if rng.random() < 0.2:
+                    data = bytearray(rng.randrange(256) for k in range(rng.randint(0, 20)))
+                    buffer.put_bytes(data)
+                    bits += ''.join('{0:08b}'.format(byte) for byte in data)
+                else:
+                    length = rng.randint(0, 40)
+                    num = rng.getrandbits(length) if length else 0
+                    buffer.put(num, length)
+                    bits += '{0:0{1}b}'.format(num, length) if length else ''
+            self.assertEqual(len(buffer), len(bits))
+            padded = bits + '0' * (-len(bits) % 8)
+            self.assertEqual(list(buffer.buffer), [int(padded[k:k + 8], 2) for k in range(0, len(padded), 8)])
+            self.assertEqual([buffer.get(k) for k in range(len(bits))], [bit == '1' for bit in bits])
+
+
+class MatrixTest(unittest.TestCase):
+
+    def test_best_fit_codes(self):
+        for (index, error_correction), (version, digest) in FITTED.items():
+            qr = QRCode(error_correction=error_correction, border=2)
+            qr.add_data(PAYLOADS[index])
+            matrix = qr.get_matrix()
+            self.assertEqual((qr.version, matrix_digest(matrix)), (version, digest), (index, error_correction))
+
+    def test_every_version_and_mask(self):
+        for version, digests in MASKED.items():
+            for mask_pattern, digest in enumerate(digests):
+                qr = QRCode(version=version, error_correction=EC_LEVELS[version % 4], border=0)
+                qr.add_data('chapter %d' % version)
+                qr.makeImpl(False, mask_pattern)
+                self.assertEqual(matrix_digest(qr.get_matrix()), digest, (version, mask_pattern))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+"""
+Check that the mask penalty of the QR encoder is unchanged by its optimizations
+
+Run from the repository root: python -m unittest tests.test_lost_point
+"""
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import unittest
+
+from extern import constants, util
+from extern.main import QRCode
+
+EC_LEVELS = (constants.ERROR_CORRECT_L, constants.ERROR_CORRECT_M,
+             constants.ERROR_CORRECT_Q, constants.ERROR_CORRECT_H)
+
+
+def reference_lost_point(modules):
+    """The mask penalty of qrcode 5.3, computed on a list of lists of booleans"""
+    count = len(modules)
+    lost_point = 0
+
+    # level 1: runs of same colored neighbours
+    for row in range(count):
+        for col in range(count):
+            same_count = 0
+            dark = modules[row][col]
+            for r in range(-1, 2):
+                if row + r < 0 or count <= row + r:
+                    continue
+                for c in range(-1, 2):
+                    if col + c < 0 or count <= col + c:
+                        continue
+                    if r == 0 and c == 0:
+                        continue
+                    if dark == modules[row + r][col + c]:
+                        same_count += 1
+            if same_count > 5:
+                lost_point += (3 + same_count - 5)
+
+    # level 2: 2x2 blocks of one color
+    for row in range(count - 1):
+        for col in range(count - 1):
+            block = (modules[row][col], modules[row][col + 1], modules[row + 1][col], modules[row + 1][col + 1])
+            if all(block) or not any(block):
+                lost_point += 3
+
+    # level 3: 1:1:3:1:1 finder-like patterns, in rows and columns
+    pattern = [True, False, True, True, True, False, True]
+    columns = [[modules[row][col] for row in range(count)] for col in range(count)]
+    for line in list(modules) + columns:
+        for col in range(count - 6):
+            if [bool(x) for x in line[col:col + 7]] == pattern:
+                lost_point += 40
+
+    # level 4: proportion of dark modules
+    dark_count = sum(1 for row in modules for x in row if x)
+    ratio = abs(100 * dark_count / count / count - 50) / 5
+    return lost_point + ratio * 10
+
+
+def masked_matrix(version, mask_pattern):
+    """Return the module matrix of a sample symbol of version, drawn with mask_pattern"""
+    qr = QRCode(version=version, error_correction=EC_LEVELS[version % 4])
+    qr.add_data('chapter {0}-{1}'.format(version, mask_pattern))
+    qr.makeImpl(False, mask_pattern)
+    return qr.modules
+
+
+class LostPointTest(unittest.TestCase):
+
+    def test_python_matches_reference(self):
+        for version in range(1, 41):
+            for mask_pattern in range(8):
+                modules = masked_matrix(version, mask_pattern)
+                expected = reference_lost_point(modules.to_list())
+                self.assertEqual(util._lost_point_python(modules), expected, (version, mask_pattern))
+                self.assertEqual(util.lost_point(modules.to_list()), expected, (version, mask_pattern))
+
+    @unittest.skipIf(util._import_numpy() is None, 'numpy is not installed')
+    def test_numpy_matches_python(self):
+        for version in range(1, 41):
+            for mask_pattern in range(8):
+                modules = masked_matrix(version, mask_pattern)
+                self.assertEqual(util._lost_point_numpy(modules), util._lost_point_python(modules),
+                                 (version, mask_pattern))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+from collections import OrderedDict
+import time
+
+clock = getattr(time, 'perf_counter', time.time)  # monotonic, where available
+
+
+class _Stage(object):
+    """Context manager timing one call of a stage"""
+
+    __slots__ = ('timer', 'stage', 'name', 'start', 'nested')
+
+    def __init__(self, timer, stage, name):
+        """Store what is timed"""
+        self.timer = timer
+        self.stage = stage
+        self.name = name
+
+    def __enter__(self):
+        """Start timing"""
+        self.nested = self.timer.enter(self.name)
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Account for elapsed time"""
+        seconds = clock() - self.start
+        self.timer.exit(self.name)
+        self.timer.add(self.stage, seconds, self.name, self.nested)
+
+
+class StageTimer(object):
+    """
+    Time spent and calls made in each stage of a run, overall and per chapter, along with counters
+
+    Time a stage with ``with timer.stage('title', name):``, count events with ``timer.count('parsed')``.
+    Stages of a chapter may be nested (e.g. 'parse' within 'score'): the chapter total only counts
+    the outermost ones.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        """Start with no stage"""
+        self.stages = OrderedDict()  # stage -> [seconds, calls]
+        self.chapters = {}  # name -> {stage: seconds}
+        self.chapter_totals = {}  # name -> seconds in outermost stages
+        self.counters = OrderedDict()
+        self.running = {}  # name -> number of stages of that chapter being timed
+
+    def stage(self, stage, name=None):
+        """Return a context manager timing a stage, for the chapter called name if given"""
+        return _Stage(self, stage, name)
+
+    def enter(self, name):
+        """Note that a stage of chapter name starts, return whether it is nested in another one"""
+        if name is None:
+            return False
+        depth = self.running.get(name, 0)
+        self.running[name] = depth + 1
+        return depth > 0
+
+    def exit(self, name):
+        """Note that a stage of chapter name ends"""
+        if name is not None:
+            self.running[name] -= 1
+
+    def add(self, stage, seconds, name=None, nested=False):
+        """Account for a call of a stage, nested in another stage of the same chapter or not"""
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0.0, 0]
+        entry[0] += seconds
+        entry[1] += 1
+        if name is not None:
+            chapter = self.chapters.setdefault(name, {})
+            chapter[stage] = chapter.get(stage, 0.0) + seconds
+            if not nested:
+                self.chapter_totals[name] = self.chapter_totals.get(name, 0.0) + seconds
+
+    def count(self, counter, n=1):
+        """Increment a counter"""
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def report(self, slowest=10):
+        """Return a plain text report, listing the slowest chapters"""
+        lines = ['{0:<20} {1:>8} {2:>12} {3:>10}'.format('Stage', 'Calls', 'Total (s)', 'Mean (ms)')]
+        for stage, (seconds, calls) in self.stages.items():
+            lines.append('{0:<20} {1:>8} {2:>12.3f} {3:>10.2f}'.format(stage, calls, seconds, seconds / calls * 1000))
+        if self.counters:
+            lines.append('')
+            lines.append('Counters: ' + ', '.join('{0} {1}'.format(k, v) for k, v in self.counters.items()))
+        names = sorted(self.chapter_totals, key=self.chapter_totals.get, reverse=True)[:slowest]
+        if names:
+            lines.append('')
+            lines.append('Slowest chapters (nested stages are part of their enclosing stage time):')
+            for name in names:
+                lines.append('{0:.3f}s {1} ({2})'.format(
+                    self.chapter_totals[name], name,
+                    ', '.join('{0} {1:.3f}s'.format(stage, seconds)
+                              for stage, seconds in sorted(self.chapters[name].items()))))
+        return '\n'.join(lines)
+
+
+class _NullStage(object):
+    """Context manager doing nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class NullTimer(object):
+    """``StageTimer`` lookalike recording nothing, used when instrumentation is disabled"""
+
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, stage, name=None):
+        """Return a context manager doing nothing"""
+        return self._stage
+
+    def enter(self, name):
+        return False
+
+    def exit(self, name):
+        pass
+
+    def add(self, stage, seconds, name=None, nested=False):
+        pass
+
+    def count(self, counter, n=1):
+        pass
+
+    def report(self, slowest=10):
+        return ''
+
+
+NULL_TIMER = NullTimer()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# vim:fileencoding=utf-8:ai:ts=4:sw=4:et:sts=4:tw=128:
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2016-2019, Marco77 <http://www.mobileread.com/forums/member.php?u=271721>'
+__docformat__ = 'restructuredtext en'
+
+import six
+import sys
+from PyQt5.Qt import (
+    Qt,
+    QApplication,
+    QEventLoop,
+    QProgressDialog,
+    QThread,
+    pyqtSignal)
+
+
+class Canceled(Exception):
+    """Raised when the user cancels a running operation"""
+
+
+class ProgressWorker(QThread):
+    """
+    Run a function in a background thread
+
+    The function receives a ``report(done, total, label=None)`` callback, which emits progress
+    and raises ``Canceled`` once ``cancel()`` has been called.
+    If profiler (a ``RunProfiler``) is given, the function runs through its ``runcall()``.
+    """
+
+    progress = pyqtSignal(int, int, object)
+
+    def __init__(self, func, parent=None, profiler=None):
+        """Store function to run"""
+        QThread.__init__(self, parent)
+        self.func = func
+        self.profiler = profiler
+        self.canceled = False
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        """Implement function defined in base class"""
+        try:
+            if self.profiler is not None:
+                self.result = self.profiler.runcall(self.func, self.report)
+            else:
+                self.result = self.func(self.report)
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+    def report(self, done, total, label=None):
+        """Progress callback handed to the function"""
+        if self.canceled:
+            raise Canceled()
+        self.progress.emit(done, total, label)
+
+    def cancel(self):
+        """Ask the function to stop at its next progress report"""
+        self.canceled = True
+
+
+class ProgressRunner(object):
+    """
+    Show a progress dialog with a Cancel button while running work in stages
+
+    Stages either run in a ``ProgressWorker`` thread (see ``run_in_thread``), or on the GUI thread,
+    calling ``report()`` between batches of work.
+    """
+
+    # RunProfiler profiling the background threads, if any
+    profiler = None
+
+    def __init__(self, parent, title):
+        """
+        Create and show the dialog
+
+        It is shown at once, as its window modality is what keeps the user from editing the book
+        while a background thread reads it.
+        """
+        self.dialog = QProgressDialog(title, _('Cancel'), 0, 0, parent)
+        self.dialog.setWindowTitle(title)
+        self.dialog.setWindowModality(Qt.WindowModal)
+        self.dialog.setMinimumDuration(0)
+        self.dialog.setAutoReset(False)
+        self.dialog.setAutoClose(False)
+        self.dialog.show()
+
+    def run_in_thread(self, func, label):
+        """
+        Run func(report) in a background thread, and return its result
+
+        Keep the GUI responsive meanwhile, and re-raise exceptions from the thread,
+        ``Canceled`` included
+        """
+        self.dialog.setLabelText(label)
+        worker = ProgressWorker(func, profiler=self.profiler)
+        worker.progress.connect(self._set_progress, type=Qt.QueuedConnection)
+        self.dialog.canceled.connect(worker.cancel)
+        loop = QEventLoop()
+        worker.finished.connect(loop.quit, type=Qt.QueuedConnection)
+        worker.start()
+        loop.exec_()
+        worker.wait()
+        self.dialog.canceled.disconnect(worker.cancel)
+        if worker.exc_info is not None:
+            six.reraise(*worker.exc_info)  # with the traceback of the thread, on Python 2 too
+        if self.dialog.wasCanceled():
+            raise Canceled()
+        return worker.result
+
+    def report(self, done, total, label=None):
+        """Update the dialog from the GUI thread, raise ``Canceled`` if the user asked to"""
+        self._set_progress(done, total, label)
+        QApplication.processEvents()
+        if self.dialog.wasCanceled():
+            raise Canceled()
+
+    def _set_progress(self, done, total, label=None):
+        """Show progress in dialog"""
+        if label is not None:
+            self.dialog.setLabelText(label)
+        self.dialog.setMaximum(total)
+        self.dialog.setValue(done)
+
+    def close(self):
+        """Hide dialog"""
+        self.dialog.reset()
+        self.dialog.close()